@@ -13,17 +13,27 @@ from dateutil.relativedelta import relativedelta
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 import settings as st
+from modules.error_replay import add_retry_error_arguments, get_retry_filter, select_repositories, merge_previous_results
+from modules.dirty_update import add_only_dirty_argument
+from modules.analyzed_paths import CODEOWNERS_PATHS
+from modules.repository_reader import open_repository, get_repository_manifest
+from modules.clone_cache import mark_consumed
 
 
 def should_apply_practice(repo_dir, repository_data):
     return True
 
 def is_practice_implemented(repo_dir, repository_data):
+    with open_repository(repo_dir) as repository:
+        manifest = get_repository_manifest(repository, repository_data)
+        return check_codeowners(repository, manifest)
+
+def check_codeowners(repository, manifest):
     valid_codeowners_files = []
     target_codeowners_file = None
     codeowners_rules = []
 
-    codeowners_files = list(Path(repo_dir).rglob("CODEOWNERS"))
+    codeowners_files = manifest["codeowners_files"]
     if codeowners_files:
         has_codeowners = True
     else:
@@ -31,19 +41,18 @@ def is_practice_implemented(repo_dir, repository_data):
 
     if has_codeowners:
         for codeowner_file in codeowners_files:
-            codeowners_path =  str(codeowner_file.relative_to(repo_dir))
-            if codeowners_path == ".github/CODEOWNERS" or codeowners_path == "CODEOWNERS" or codeowners_path == "docs/CODEOWNERS":
+            codeowners_path =  codeowner_file
+            if codeowners_path in CODEOWNERS_PATHS:
                 valid_codeowners_files.append(codeowners_path)
         
 
         if valid_codeowners_files != []:
-            priority_coddeowners_files = [".github/CODEOWNERS", "CODEOWNERS", "docs/CODEOWNERS"]
-            for priority_file in priority_coddeowners_files:
+            for priority_file in CODEOWNERS_PATHS:
                 if priority_file in valid_codeowners_files:
-                    target_codeowners_file = os.path.join(repo_dir, priority_file)
+                    target_codeowners_file = priority_file
                     break
 
-            with open(target_codeowners_file, "r", errors='ignore') as f:
+            with repository.open(target_codeowners_file, errors='ignore') as f:
                 lines = f.readlines()
 
             for line in lines:
@@ -70,9 +79,9 @@ def analyze_practice(repo_dir, repository_data):
         "is_implemented": is_implemented
     }
 
-def process_month(year, month):
+def process_month(year, month, retry_filter=None, only_dirty=False):
     output_path = os.path.join(st.P1_ANALYZED_DATA_DIR, f"p1_analyzed_data_{year}_{month}.json")
-    if st.ALLOW_OVERWRITE == False and os.path.exists(output_path):
+    if st.ALLOW_OVERWRITE == False and os.path.exists(output_path) and retry_filter is None and only_dirty == False:
         print(f"[Skip] File already exists: {output_path}")
         return
 
@@ -94,6 +103,11 @@ def process_month(year, month):
     with open(source_file2, "r") as f:
         source_data2 = json.load(f)
 
+    selection = select_repositories(output_path, source_data1, retry_filter, only_dirty, year, month)
+    if selection is None:
+        return
+    repository_names, previous_results, _ = selection
+
     results = {
         "SEARCH_DATE": f'{year}-{month}',
         "SUCCESS": {},
@@ -101,7 +115,7 @@ def process_month(year, month):
     }
 
     count = 0
-    for repository_name in tqdm.tqdm(source_data1["True"],desc=f"{year}-{month}"):
+    for repository_name in tqdm.tqdm(repository_names,desc=f"{year}-{month}"):
         repo_dir = os.path.join(st.CLONED_DIR, repository_name)
         if not os.path.exists(repo_dir):
             # print(f"[Warning] Repository not found: {repository_name}")
@@ -116,19 +130,22 @@ def process_month(year, month):
             print("\nDebug Mode: Stop after limited data")
             break
 
+    results = merge_previous_results(previous_results, results, retry_filter, source_data1["True"])
 
     with open(output_path, "w") as f:
         json.dump(results, f, indent=4)
 
+    mark_consumed("p1", results["SUCCESS"].keys())
+
 def generate_year_months(start, end):
     current = start
     while current <= end:
         yield current.year, current.month
         current += relativedelta(months=1)
 
-def process_range(start_date, end_date):
+def process_range(start_date, end_date, retry_filter=None, only_dirty=False):
     for year, month in generate_year_months(start_date, end_date):
-        process_month(year, month)
+        process_month(year, month, retry_filter, only_dirty)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -140,12 +157,14 @@ def main():
     parser.add_argument(
         "--end", type=str, required=True, help="End year-month in format YYYY-MM (e.g., 2025-10)"
     )
+    add_retry_error_arguments(parser)
+    add_only_dirty_argument(parser)
     args = parser.parse_args()
 
     start_date = datetime.strptime(args.start, "%Y-%m")
     end_date = datetime.strptime(args.end, "%Y-%m")
 
-    process_range(start_date, end_date)
+    process_range(start_date, end_date, get_retry_filter(args), args.only_dirty)
 
 
 if __name__ == "__main__":
@@ -13,21 +13,33 @@ from dateutil.relativedelta import relativedelta
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 import settings as st
+from modules.error_replay import add_retry_error_arguments, get_retry_filter, select_repositories, merge_previous_results
+from modules.dirty_update import add_only_dirty_argument
+from modules.workflow_store import resolve_repository_data
 
-def get_context_labels(workflow_data):
+def get_step_label(step_data, expression_labels=False):
+    ### With expression_labels, the labels that count only contexts used inside `${{ }}` (see get_expression_label of
+    ### github_context_parser). Repository data analyzed before they were added falls back to "label".
+    if expression_labels == True and "expression_label" in step_data:
+        return step_data["expression_label"]
+    return step_data["label"]
+
+
+def get_context_labels(workflow_data, expression_labels=False):
     context_labels = []
     for job_name, job_data in workflow_data["job_result"].items():
         for step_id, step_data in job_data["step_result"].items():
-            if step_data["label"] == []:
+            step_label = get_step_label(step_data, expression_labels)
+            if step_label == []:
                 continue
                 
-            if "injection_risk_basic" in step_data["label"] or "injection_risk_matrix" in step_data["label"]:
+            if "injection_risk_basic" in step_label or "injection_risk_matrix" in step_label or "injection_risk_env" in step_label:
                 context_labels.append("injection_risk")
             else:
-                if "practice1_basic" in step_data["label"] or "practice1_matrix" in step_data["label"] or "practice1_env" in step_data["label"]:
+                if "practice1_basic" in step_label or "practice1_matrix" in step_label or "practice1_env" in step_label:
                     context_labels.append("practice1")
 
-                elif "practice2" in step_data["label"]:
+                elif "practice2" in step_label:
                     context_labels.append("practice2")
                 else:
                     pass
@@ -35,7 +47,7 @@ def get_context_labels(workflow_data):
     return context_labels    
 
 
-def should_apply_practice(repo_dir, repository_data):
+def should_apply_practice(repo_dir, repository_data, expression_labels=False):
     context_pattern = {}
     for workflow_name, workflow_data in repository_data["WORKFLOWS_DATA"]["workflows"].items():
         if workflow_data["is_valid"] == True:
@@ -45,7 +57,7 @@ def should_apply_practice(repo_dir, repository_data):
                 context_pattern[workflow_name] = False
                 continue
 
-            context_labels = get_context_labels(context_data)
+            context_labels = get_context_labels(context_data, expression_labels)
 
             if context_labels == []:
                 context_pattern[workflow_name] = False
@@ -57,7 +69,7 @@ def should_apply_practice(repo_dir, repository_data):
     else:
         return False
 
-def is_practice_implemented(repo_dir, repository_data):
+def is_practice_implemented(repo_dir, repository_data, expression_labels=False):
     practice_pattern = {}
     for workflow_name, workflow_data in repository_data["WORKFLOWS_DATA"]["workflows"].items():
         if workflow_data["is_valid"] == True:
@@ -66,7 +78,7 @@ def is_practice_implemented(repo_dir, repository_data):
             if context_data["use_github_context"] == False:
                 continue
 
-            context_labels = get_context_labels(context_data)
+            context_labels = get_context_labels(context_data, expression_labels)
 
             if context_labels == []:
                 continue
@@ -82,22 +94,41 @@ def is_practice_implemented(repo_dir, repository_data):
         return True
 
 
-def analyze_practice(repo_dir, repository_data):
-    is_target = should_apply_practice(repo_dir, repository_data)
+def get_injection_rules(repo_dir, repository_data):
+    ### Rules of modules/injection_rules.py fired in any step. They do not change is_target or is_implemented.
+    ### Repository data analyzed before the rules were added has no "injection_rules" and gives [].
+    injection_rules = set()
+    for workflow_name, workflow_data in repository_data["WORKFLOWS_DATA"]["workflows"].items():
+        if workflow_data["is_valid"] == True:
+            context_data = workflow_data["context_data"]
+
+            ### Unlike the labels, rules such as github.head_ref also fire in workflows without use_github_context;
+            ### get_context_data records those for the whole workflow.
+            injection_rules.update(context_data.get("injection_rules", []))
+            for job_name, job_data in context_data["job_result"].items():
+                for step_id, step_data in job_data["step_result"].items():
+                    injection_rules.update(step_data.get("injection_rules", []))
+
+    return sorted(injection_rules)
+
+
+def analyze_practice(repo_dir, repository_data, expression_labels=False):
+    is_target = should_apply_practice(repo_dir, repository_data, expression_labels)
 
     if is_target == True:
-        is_implemented = is_practice_implemented(repo_dir, repository_data)
+        is_implemented = is_practice_implemented(repo_dir, repository_data, expression_labels)
     else:
         is_implemented = None
 
     return {
         "is_target": is_target,
-        "is_implemented": is_implemented
+        "is_implemented": is_implemented,
+        "injection_rules": get_injection_rules(repo_dir, repository_data)
     }
 
-def process_month(year, month):
+def process_month(year, month, retry_filter=None, only_dirty=False, expression_labels=False):
     output_path = os.path.join(st.P2_ANALYZED_DATA_DIR, f"p2_analyzed_data_{year}_{month}.json")
-    if st.ALLOW_OVERWRITE == False and os.path.exists(output_path):
+    if st.ALLOW_OVERWRITE == False and os.path.exists(output_path) and retry_filter is None and only_dirty == False:
         print(f"[Skip] File already exists: {output_path}")
         return
     
@@ -119,6 +150,11 @@ def process_month(year, month):
     with open(source_file2, "r") as f:
         source_data2 = json.load(f)
 
+    selection = select_repositories(output_path, source_data1, retry_filter, only_dirty, year, month)
+    if selection is None:
+        return
+    repository_names, previous_results, _ = selection
+
     results = {
         "SEARCH_DATE": f'{year}-{month}',
         "SUCCESS": {},
@@ -126,21 +162,22 @@ def process_month(year, month):
     }
 
     count = 0
-    for repository_name in tqdm.tqdm(source_data1["True"],desc=f"{year}-{month}"):
+    for repository_name in tqdm.tqdm(repository_names,desc=f"{year}-{month}"):
         repo_dir = os.path.join(st.CLONED_DIR, repository_name)
         if not os.path.exists(repo_dir):
             # print(f"[Warning] Repository not found: {repository_name}")
             results["ERROR"][repository_name] = "Repository data not found"
             continue
 
-        repository_data = source_data2["SUCCESS"][repository_name]
-        results["SUCCESS"][repository_name] = analyze_practice(repo_dir, repository_data)
+        repository_data = resolve_repository_data(source_data2["SUCCESS"][repository_name])
+        results["SUCCESS"][repository_name] = analyze_practice(repo_dir, repository_data, expression_labels)
 
         count += 1
         if st.DEBUG == True and count > st.DEBUG_DATA_NUM:
             print("\nDebug Mode: Stop after limited data")
             break
 
+    results = merge_previous_results(previous_results, results, retry_filter, source_data1["True"])
 
     with open(output_path, "w") as f:
         json.dump(results, f, indent=4)
@@ -151,9 +188,9 @@ def generate_year_months(start, end):
         yield current.year, current.month
         current += relativedelta(months=1)
 
-def process_range(start_date, end_date):
+def process_range(start_date, end_date, retry_filter=None, only_dirty=False, expression_labels=False):
     for year, month in generate_year_months(start_date, end_date):
-        process_month(year, month)
+        process_month(year, month, retry_filter, only_dirty, expression_labels)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -165,12 +202,17 @@ def main():
     parser.add_argument(
         "--end", type=str, required=True, help="End year-month in format YYYY-MM (e.g., 2025-10)"
     )
+    add_retry_error_arguments(parser)
+    add_only_dirty_argument(parser)
+    parser.add_argument(
+        "--expression-labels", action="store_true", help="Count only contexts used inside ${{ }} expressions"
+    )
     args = parser.parse_args()
 
     start_date = datetime.strptime(args.start, "%Y-%m")
     end_date = datetime.strptime(args.end, "%Y-%m")
 
-    process_range(start_date, end_date)
+    process_range(start_date, end_date, get_retry_filter(args), args.only_dirty, args.expression_labels)
 
 
 if __name__ == "__main__":
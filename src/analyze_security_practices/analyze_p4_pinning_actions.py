@@ -15,6 +15,9 @@ from dateutil.relativedelta import relativedelta
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 import settings as st
+from modules.error_replay import add_retry_error_arguments, get_retry_filter, select_repositories, merge_previous_results
+from modules.dirty_update import add_only_dirty_argument
+from modules.workflow_store import resolve_repository_data
 from modules.github_api import get_access_token, get_rate_limit
 
 
@@ -52,7 +55,7 @@ def should_apply_practice(repo_dir, repository_data):
 
 
 def check_short_sha1_commit(actions_repository_name, short_sha1):
-    access_token, expires_at = get_access_token(st.config["1"])
+    access_token, expires_at = get_access_token()
     try:
         headers = {
             "Authorization": f"Bearer {access_token}",
@@ -180,9 +183,9 @@ def analyze_practice(repo_dir, repository_data):
         "is_implemented": is_implemented
     }
 
-def process_month(year, month):
+def process_month(year, month, retry_filter=None, only_dirty=False):
     output_path = os.path.join(st.P4_ANALYZED_DATA_DIR, f"p4_analyzed_data_{year}_{month}.json")
-    if st.ALLOW_OVERWRITE == False and os.path.exists(output_path):
+    if st.ALLOW_OVERWRITE == False and os.path.exists(output_path) and retry_filter is None and only_dirty == False:
         print(f"[Skip] File already exists: {output_path}")
         return
     
@@ -204,6 +207,11 @@ def process_month(year, month):
     with open(source_file2, "r") as f:
         source_data2 = json.load(f)
 
+    selection = select_repositories(output_path, source_data1, retry_filter, only_dirty, year, month)
+    if selection is None:
+        return
+    repository_names, previous_results, _ = selection
+
     results = {
         "SEARCH_DATE": f'{year}-{month}',
         "SUCCESS": {},
@@ -211,14 +219,14 @@ def process_month(year, month):
     }
 
     count = 0
-    for repository_name in tqdm.tqdm(source_data1["True"],desc=f"{year}-{month}"):
+    for repository_name in tqdm.tqdm(repository_names,desc=f"{year}-{month}"):
         repo_dir = os.path.join(st.CLONED_DIR, repository_name)
         if not os.path.exists(repo_dir):
             # print(f"[Warning] Repository not found: {repository_name}")
             results["ERROR"][repository_name] = "Repository data not found"
             continue
 
-        repository_data = source_data2["SUCCESS"][repository_name]
+        repository_data = resolve_repository_data(source_data2["SUCCESS"][repository_name])
         results["SUCCESS"][repository_name] = analyze_practice(repo_dir, repository_data)
 
         count += 1
@@ -226,6 +234,7 @@ def process_month(year, month):
             print("\nDebug Mode: Stop after limited data")
             break
 
+    results = merge_previous_results(previous_results, results, retry_filter, source_data1["True"])
 
     with open(output_path, "w") as f:
         json.dump(results, f, indent=4)
@@ -236,9 +245,9 @@ def generate_year_months(start, end):
         yield current.year, current.month
         current += relativedelta(months=1)
 
-def process_range(start_date, end_date):
+def process_range(start_date, end_date, retry_filter=None, only_dirty=False):
     for year, month in generate_year_months(start_date, end_date):
-        process_month(year, month)
+        process_month(year, month, retry_filter, only_dirty)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -250,12 +259,14 @@ def main():
     parser.add_argument(
         "--end", type=str, required=True, help="End year-month in format YYYY-MM (e.g., 2025-10)"
     )
+    add_retry_error_arguments(parser)
+    add_only_dirty_argument(parser)
     args = parser.parse_args()
 
     start_date = datetime.strptime(args.start, "%Y-%m")
     end_date = datetime.strptime(args.end, "%Y-%m")
 
-    process_range(start_date, end_date)
+    process_range(start_date, end_date, get_retry_filter(args), args.only_dirty)
 
 
 if __name__ == "__main__":
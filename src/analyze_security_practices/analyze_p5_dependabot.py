@@ -13,6 +13,13 @@ from dateutil.relativedelta import relativedelta
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 import settings as st
+from modules.error_replay import add_retry_error_arguments, get_retry_filter, select_repositories, merge_previous_results
+from modules.dirty_update import add_only_dirty_argument
+from modules.workflow_store import resolve_repository_data
+from modules.analyzed_paths import DEPENDABOT_PATHS
+from modules.repository_reader import open_repository, get_repository_manifest
+from modules.clone_cache import mark_consumed
+from modules import yaml_loader
 
 
 def should_apply_practice(repo_dir, repository_data):
@@ -28,34 +35,42 @@ def should_apply_practice(repo_dir, repository_data):
     return has_public_actions
 
 def is_practice_implemented(repo_dir, repository_data):
+    with open_repository(repo_dir) as repository:
+        manifest = get_repository_manifest(repository, repository_data)
+        return check_dependabot(repository, manifest)
+
+def check_dependabot(repository, manifest):
     valid_dependabot_file = None
     ecosystems = []
 
-    dependabot_files = list(Path(repo_dir).rglob("dependabot.y*ml"))
+    dependabot_files = manifest["dependabot_files"]
     if dependabot_files:
         for dependabot_file in dependabot_files:
-            if os.path.islink(dependabot_file):
+            if dependabot_file["is_symlink"] == True:
                 continue
 
-            dependabot_path =  str(dependabot_file.relative_to(repo_dir))
-            if dependabot_path == ".github/dependabot.yml" or dependabot_path == ".github/dependabot.yaml":
-                valid_dependabot_file = dependabot_file
+            dependabot_path =  dependabot_file["path"]
+            if dependabot_path in DEPENDABOT_PATHS:
+                valid_dependabot_file = dependabot_path
                 break
 
         if valid_dependabot_file != None:
-            with open(valid_dependabot_file, "r", errors='ignore') as f:
+            with repository.open(valid_dependabot_file, errors='ignore') as f:
                 try:
-                    data = yaml.safe_load(f)
+                    data = yaml_loader.safe_load(f)
                     for update in data.get('updates', []):
                         if 'package-ecosystem' in update:
                             ecosystems.append(update['package-ecosystem'])
 
+                except yaml_loader.YAMLLimitError as e:
+                    print(f"[Warning] Skipped {valid_dependabot_file} of {repository.repo_dir}: {str(e)}")
+
                 except yaml.YAMLError as e:
-                    # print(f"Error: DependabotYAMLError {str(e)} {repo_dir}")
+                    # print(f"Error: DependabotYAMLError {str(e)} {repository.repo_dir}")
                     pass
 
                 except Exception as e:
-                    # print(f"Error: DependabotFileError {str(e)} {repo_dir}")
+                    # print(f"Error: DependabotFileError {str(e)} {repository.repo_dir}")
                     pass
 
     if valid_dependabot_file != None and "github-actions" in ecosystems:
@@ -76,9 +91,9 @@ def analyze_practice(repo_dir, repository_data):
         "is_implemented": is_implemented
     }
 
-def process_month(year, month):
+def process_month(year, month, retry_filter=None, only_dirty=False):
     output_path = os.path.join(st.P5_ANALYZED_DATA_DIR, f"p5_analyzed_data_{year}_{month}.json")
-    if st.ALLOW_OVERWRITE == False and os.path.exists(output_path):
+    if st.ALLOW_OVERWRITE == False and os.path.exists(output_path) and retry_filter is None and only_dirty == False:
         print(f"[Skip] File already exists: {output_path}")
         return
     
@@ -100,6 +115,11 @@ def process_month(year, month):
     with open(source_file2, "r") as f:
         source_data2 = json.load(f)
 
+    selection = select_repositories(output_path, source_data1, retry_filter, only_dirty, year, month)
+    if selection is None:
+        return
+    repository_names, previous_results, _ = selection
+
     results = {
         "SEARCH_DATE": f'{year}-{month}',
         "SUCCESS": {},
@@ -107,14 +127,14 @@ def process_month(year, month):
     }
 
     count = 0
-    for repository_name in tqdm.tqdm(source_data1["True"],desc=f"{year}-{month}"):
+    for repository_name in tqdm.tqdm(repository_names,desc=f"{year}-{month}"):
         repo_dir = os.path.join(st.CLONED_DIR, repository_name)
         if not os.path.exists(repo_dir):
             # print(f"[Warning] Repository not found: {repository_name}")
             results["ERROR"][repository_name] = "Repository data not found"
             continue
 
-        repository_data = source_data2["SUCCESS"][repository_name]
+        repository_data = resolve_repository_data(source_data2["SUCCESS"][repository_name])
         results["SUCCESS"][repository_name] = analyze_practice(repo_dir, repository_data)
 
         count += 1
@@ -122,19 +142,22 @@ def process_month(year, month):
             print("\nDebug Mode: Stop after limited data")
             break
 
+    results = merge_previous_results(previous_results, results, retry_filter, source_data1["True"])
 
     with open(output_path, "w") as f:
         json.dump(results, f, indent=4)
 
+    mark_consumed("p5", results["SUCCESS"].keys())
+
 def generate_year_months(start, end):
     current = start
     while current <= end:
         yield current.year, current.month
         current += relativedelta(months=1)
 
-def process_range(start_date, end_date):
+def process_range(start_date, end_date, retry_filter=None, only_dirty=False):
     for year, month in generate_year_months(start_date, end_date):
-        process_month(year, month)
+        process_month(year, month, retry_filter, only_dirty)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -146,12 +169,14 @@ def main():
     parser.add_argument(
         "--end", type=str, required=True, help="End year-month in format YYYY-MM (e.g., 2025-10)"
     )
+    add_retry_error_arguments(parser)
+    add_only_dirty_argument(parser)
     args = parser.parse_args()
 
     start_date = datetime.strptime(args.start, "%Y-%m")
     end_date = datetime.strptime(args.end, "%Y-%m")
 
-    process_range(start_date, end_date)
+    process_range(start_date, end_date, get_retry_filter(args), args.only_dirty)
 
 
 if __name__ == "__main__":
@@ -1,24 +1,90 @@
-import os
 import sys
 import pandas as pd
+import pyarrow as pa
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 import settings as st
+from modules.seartghs import get_seartghs_month_path, get_seartghs_parquet_path
 
-def main():
-    df = pd.read_csv(st.SEARTGHS_FILEPATH)
+### Arrow type of each column type of get_column_dtypes, for the Parquet schema.
+PARQUET_TYPES = {
+    "int64": pa.int64(),
+    "float64": pa.float64(),
+    "bool": pa.bool_(),
+    "object": pa.string()
+}
+
+
+def get_dtype_name(dtype):
+    if pd.api.types.is_bool_dtype(dtype):
+        return "bool"
+    elif pd.api.types.is_integer_dtype(dtype):
+        return "int64"
+    elif pd.api.types.is_float_dtype(dtype):
+        return "float64"
+    else:
+        return "object"
+
+
+def merge_dtype_names(dtype_name1, dtype_name2):
+    if dtype_name1 == dtype_name2:
+        return dtype_name1
+    if dtype_name1 in ("int64", "float64") and dtype_name2 in ("int64", "float64"):
+        return "float64"
+    return "object"
+
+
+def get_column_dtypes():
+    ### Column types of results.csv merged over all chunks, since one chunk may only see ints in a column that holds
+    ### floats or strings further down. Reading every chunk and month with them gives the values of a single read
+    ### of the whole file (e.g. 5.0 throughout a column with missing values).
+    column_dtypes = {}
+    for df in pd.read_csv(st.SEARTGHS_FILEPATH, chunksize=st.SEARTGHS_CHUNK_SIZE, low_memory=False):
+        for column, dtype in df.dtypes.items():
+            dtype_name = get_dtype_name(dtype)
+            column_dtypes[column] = merge_dtype_names(column_dtypes.get(column, dtype_name), dtype_name)
+    return column_dtypes
 
+
+def split_chunk(df, written_months):
     df["createdAt"] = pd.to_datetime(df["createdAt"])
 
     df["year"] = df["createdAt"].dt.year
     df["month"] = df["createdAt"].dt.month
 
     for (year, month), group in df.groupby(["year", "month"]):
-        output_path = os.path.join(st.SEARTGHS_BY_MONTH_DIR, f"results_{year}_{month}.csv")
-        group.to_csv(output_path, index=False)
+        output_path = get_seartghs_month_path(year, month)
+        ### The first chunk of a month in this run replaces the old file, later chunks are appended.
+        if (year, month) in written_months:
+            group.to_csv(output_path, mode="a", header=False, index=False)
+        else:
+            group.to_csv(output_path, index=False)
+            written_months.add((year, month))
+
+
+def write_parquet(year, month, column_dtypes):
+    ### One month is read back from its CSV with the column types of the whole export, and written with an explicit
+    ### schema, so a column mixing ints and strings cannot make the conversion fail.
+    ### createdAt is kept as the text of the CSV; year and month are added by split_chunk.
+    column_dtypes = {**column_dtypes, "createdAt": "object", "year": "int64", "month": "int64"}
+    df = pd.read_csv(get_seartghs_month_path(year, month), dtype=column_dtypes, low_memory=False)
+    schema = pa.schema([(column, PARQUET_TYPES[column_dtypes[column]]) for column in df.columns])
+    df.to_parquet(get_seartghs_parquet_path(year, month), index=False, schema=schema)
+
+
+def main():
+    ### results.csv is read in chunks, so the memory use does not depend on the size of the SEART-GHS export.
+    ### A first pass over it finds the column types, so that every chunk is read with the same ones.
+    column_dtypes = get_column_dtypes()
+    written_months = set()
+    for df in pd.read_csv(st.SEARTGHS_FILEPATH, chunksize=st.SEARTGHS_CHUNK_SIZE, dtype=column_dtypes, low_memory=False):
+        split_chunk(df, written_months)
+
+    for year, month in sorted(written_months):
+        write_parquet(year, month, column_dtypes)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
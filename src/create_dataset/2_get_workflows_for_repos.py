@@ -11,30 +11,41 @@ from dateutil.relativedelta import relativedelta
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 import settings as st
-from modules.github_api import get_access_token, get_rate_limit, call_workflows_api, call_get_repository_api
+from modules.journal import Journal
+from modules.error_replay import add_retry_error_arguments, get_retry_filter, select_error_repositories, merge_retry_results
+from modules.seartghs import load_seartghs_month
+from modules.github_api import get_rate_limit_status, call_api_batch, call_workflows_api, call_workflows_graphql_api_batch, call_get_repository_api
 
-def get_repo_workflows(repository_name, access_token):
+def get_repo_workflows(repository_name, access_token=None):
     is_success, result = call_workflows_api(repository_name, access_token)
     
     return is_success, result
 
-def get_repository_data(repository_name, access_token):
+def get_repo_workflows_batch(repository_names, access_token=None):
+    if st.API_BACKEND == "GRAPHQL":
+        return call_workflows_graphql_api_batch(repository_names, access_token)
+
+    batch_results = call_api_batch(call_workflows_api, repository_names, access_token)
+    return [(is_success, result.json() if is_success else result) for is_success, result in batch_results]
+
+def get_repository_data(repository_name, access_token=None):
     is_success, result = call_get_repository_api(repository_name, access_token)
     
     return is_success, result
 
-def check_repository_active(row, access_token):
-    is_active_repo = True
+SEARTGHS_COLUMNS = ["name", "isFork", "isArchived"]
+
+def check_repository_active(df_seartghs):
+    ### Vectorized over the month: True for each repository that is neither a fork nor archived.
+    is_active_repo = pd.Series(True, index=df_seartghs.index)
     
     
     ### check by SEART-GHS metadata
-    if row["isFork"] == True or row["isArchived"] == True:
-    ## if row["isFork"] == True or row["isArchived"] == True or row["isDisabled"] == True:
-        ## print(f"Exclude: {repository_name}")
-        is_active_repo = False
+    is_active_repo &= ~((df_seartghs["isFork"] == True) | (df_seartghs["isArchived"] == True))
+    ## is_active_repo &= ~((df_seartghs["isFork"] == True) | (df_seartghs["isArchived"] == True) | (df_seartghs["isDisabled"] == True))
 
     ### check by GitHub API
-    # is_success, result = get_repository_data(row["name"], access_token)
+    # is_success, result = get_repository_data(row["name"])
     # if is_success:
     #     result = result.json()
     #     if result["fork"] == True or result["archived"] == True:
@@ -49,19 +60,69 @@ def check_repository_active(row, access_token):
     return is_active_repo    
 
 
-def process_month(year, month):
+def fetch_workflows(year, month, repository_names, journal, done_num, data_num):
+    count = done_num
+    for batch_start in range(0, len(repository_names), st.API_BATCH_SIZE):
+        batch = repository_names[batch_start:batch_start + st.API_BATCH_SIZE]
+        count += len(batch)
+
+        batch_results = get_repo_workflows_batch(batch)
+        for repository_name, (is_success, result) in zip(batch, batch_results):
+            if is_success:
+                journal.append(repository_name, "SUCCESS", result)
+            else:
+                journal.append(repository_name, "ERROR", result)
+
+        if st.API_BACKEND == "GRAPHQL":
+            limit_num, remaining, reset_time_utc = get_rate_limit_status("graphql")
+        else:
+            limit_num, remaining, reset_time_utc = get_rate_limit_status()
+
+        sys.stdout.write(f"\r[{year}-{month}] Count: {count}/{data_num} RateLimit:{remaining}/{limit_num} ResetTime: {reset_time_utc.strftime('%Y-%m-%d %H:%M:%S')}")
+        sys.stdout.flush()        
+
+        if st.LOOP_SLEEP_TIME > 0:
+            time.sleep(st.LOOP_SLEEP_TIME)
+
+
+def retry_month_errors(year, month, retry_filter):
+    output_path = os.path.join(st.REPO_WORKFLOWS_DIR, f'workflows_{year}_{month}.json')
+    if os.path.exists(output_path) == False:
+        print(f"[Error] File not found: {output_path}")
+        return
+
+    with open(output_path, "r") as f:
+        results = json.load(f)
+
+    repository_names = select_error_repositories(results["ERROR"], retry_filter)
+    print(f"[{year}-{month}] Retry: {len(repository_names)} of {len(results['ERROR'])} errored repositories")
+
+    journal = Journal(os.path.join(st.JOURNAL_DIR, f'workflows_retry_{year}_{month}.jsonl'))
+    fetch_workflows(year, month, repository_names, journal, 0, len(repository_names))
+    retry_results = journal.compact({"SUCCESS": {}, "ERROR": {}}, repository_names)
+
+    results = merge_retry_results(results, retry_results)
+    results["RETRIED_AT"] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=4)
+
+    journal.remove()
+
+
+def process_month(year, month, resume=False, retry_filter=None):
+    if retry_filter is not None:
+        retry_month_errors(year, month, retry_filter)
+        return
+
     output_path = os.path.join(st.REPO_WORKFLOWS_DIR, f'workflows_{year}_{month}.json')
     if st.ALLOW_OVERWRITE == False and os.path.exists(output_path) == True:
         print(f'Skip: {year}-{month}')
         return
     
-    source_file = os.path.join(st.SEARTGHS_BY_MONTH_DIR, f"results_{year}_{month}.csv")
-    if os.path.exists(source_file) == False:
-        print(f"[Error] File not found: {source_file}")
+    df_seartghs = load_seartghs_month(year, month, SEARTGHS_COLUMNS)
+    if df_seartghs is None:
         return
 
-    df_seartghs = pd.read_csv(source_file)
-
     results = {
         "SEARCH_DATE": f'{year}-{month}',
         "STARTED_AT": datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S'),
@@ -70,45 +131,25 @@ def process_month(year, month):
         "ERROR": {},
     }
 
-    count = 0
-    remaining = 5000
     data_num = df_seartghs.shape[0]
-    access_token, expires_at = get_access_token()
-    for _, row in df_seartghs.iterrows():
-        is_active_repo = check_repository_active(row, access_token)
-        if is_active_repo == False:
-            continue
-        
-        count += 1
-        if st.DEBUG == True and count > st.DEBUG_DATA_NUM:
-            print("\nDebug Mode: Stop after limited data")
-            break
-
-        if count % 5000 == 0:
-            access_token, expires_at = get_access_token()
-
-        repository_name = row["name"]
-        is_success, result = get_repo_workflows(repository_name, access_token)
-        if is_success:
-            results["SUCCESS"][repository_name] = result.json()
-            limit_num, remaining, reset_time_utc = get_rate_limit(result)
-        else:
-            results["ERROR"][repository_name] = result
+    repository_names = df_seartghs.loc[check_repository_active(df_seartghs), "name"].tolist()
+    if st.DEBUG == True and len(repository_names) > st.DEBUG_DATA_NUM:
+        print("\nDebug Mode: Stop after limited data")
+        repository_names = repository_names[:st.DEBUG_DATA_NUM]
 
-        if int(remaining) <= 100:
-            sleep_seconds = (reset_time_utc - datetime.now(timezone.utc)).total_seconds() + 60
-            print(f"[WARNING] API limit nearly reached. Sleeping for {int(sleep_seconds)} seconds until reset...")
-            time.sleep(sleep_seconds)    
+    journal = Journal(os.path.join(st.JOURNAL_DIR, f'workflows_{year}_{month}.jsonl'), resume)
+    pending_repository_names = [repository_name for repository_name in repository_names if not journal.is_done(repository_name)]
+    if resume == True:
+        print(f"[{year}-{month}] Resume: {len(repository_names) - len(pending_repository_names)} repositories already done")
 
-        sys.stdout.write(f"\r[{year}-{month}] Count: {count}/{data_num} RateLimit:{remaining}/{limit_num} ResetTime: {reset_time_utc.strftime('%Y-%m-%d %H:%M:%S')}")
-        sys.stdout.flush()        
-
-        if st.LOOP_SLEEP_TIME > 0:
-            time.sleep(st.LOOP_SLEEP_TIME)
+    fetch_workflows(year, month, pending_repository_names, journal, len(repository_names) - len(pending_repository_names), data_num)
 
+    journal.compact(results, repository_names)
     results["ENDED_AT"] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
     with open(output_path, "w") as f:
         json.dump(results, f, indent=4)
+
+    journal.remove()
     
 def generate_year_months(start, end):
     current = start
@@ -116,9 +157,9 @@ def generate_year_months(start, end):
         yield current.year, current.month
         current += relativedelta(months=1)
 
-def process_range(start_date, end_date):
+def process_range(start_date, end_date, resume=False, retry_filter=None):
     for year, month in generate_year_months(start_date, end_date):
-        process_month(year, month)
+        process_month(year, month, resume, retry_filter)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -130,12 +171,16 @@ def main():
     parser.add_argument(
         "--end", type=str, required=True, help="End year-month in format YYYY-MM (e.g., 2025-10)"
     )
+    parser.add_argument(
+        "--resume", action="store_true", help="Skip repositories already recorded in the journal of an interrupted run"
+    )
+    add_retry_error_arguments(parser)
     args = parser.parse_args()
 
     start_date = datetime.strptime(args.start, "%Y-%m")
     end_date = datetime.strptime(args.end, "%Y-%m")
 
-    process_range(start_date, end_date)
+    process_range(start_date, end_date, args.resume, get_retry_filter(args))
 
 
 if __name__ == "__main__":
@@ -2,7 +2,11 @@ import os
 import sys
 import argparse
 import json
+import base64
+import posixpath
+import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import time
 import tqdm
@@ -12,27 +16,238 @@ from dateutil.relativedelta import relativedelta
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 import settings as st
+from modules.journal import Journal
+from modules.analyzed_paths import WORKFLOWS_DIR, get_sparse_checkout_patterns, get_analyzed_directories, is_analyzed_path
+from modules.github_api import call_get_tree_api, call_get_blob_api
+from modules import clone_cache
+from modules.repository_reader import open_repository, is_bare_repository, get_analyzed_fingerprint
 
-def clone_repository(repository_name):
+def run_git(command):
+    ### Never wait for credentials: private or deleted repositories fail immediately instead of hanging.
+    env = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+    subprocess.run(
+        command,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        timeout=st.CLONE_TIMEOUT,
+        env=env
+        )
+
+
+def run_git_clone(repository_name, repo_dir):
+    repository_url = f"https://github.com/{repository_name}.git"
+
+    if st.CLONE_MODE == "SPARSE":
+        ### Latest commit only, no blobs until checkout, and only the paths read by the analyzers are checked out.
+        run_git(["git", "clone", "--depth", "1", "--filter=blob:none", "--no-checkout", repository_url, repo_dir])
+        run_git(["git", "-C", repo_dir, "sparse-checkout", "set", "--no-cone"] + get_sparse_checkout_patterns())
+        run_git(["git", "-C", repo_dir, "checkout"])
+    elif st.CLONE_MODE == "BARE":
+        ### No working tree: the repository is one packfile and files are read through modules/repository_reader.py.
+        run_git(["git", "clone", "--bare", "--depth", "1", repository_url, repo_dir])
+    else:
+        run_git(["git", "clone", repository_url, repo_dir])
+
+
+def get_tree(repository_name, tree_sha, recursive=False):
+    is_success, response = call_get_tree_api(repository_name, tree_sha, recursive)
+    if not is_success:
+        return False, response
+
+    tree_data = response.json()
+    if tree_data.get("truncated") == True:
+        return False, {"error": "Truncated Tree", "tree_sha": tree_sha}
+
+    return True, tree_data["tree"]
+
+
+def get_analyzed_file_entries(repository_name):
+    ### Walk from the root tree only through the directories that hold the analyzed paths.
+    tree_shas = {"": "HEAD"}
+    file_entries = {}
+    for directory in get_analyzed_directories():
+        if directory not in tree_shas:
+            continue
+
+        is_success, tree = get_tree(repository_name, tree_shas[directory], directory == WORKFLOWS_DIR)
+        if not is_success:
+            return False, tree
+
+        for entry in tree:
+            path = posixpath.join(directory, entry["path"])
+            if entry["type"] == "tree":
+                tree_shas[path] = entry["sha"]
+            elif entry["type"] == "blob" and is_analyzed_path(path):
+                file_entries[path] = entry
+
+    return True, file_entries
+
+
+def download_repository_files(repository_name, repo_dir):
+    ### Materialize only the analyzed files in the cloned_repos layout, so the later stages read them as a working tree.
+    ### Symbolic links are kept as links; like the SPARSE mode, a link to a path outside the analyzed paths is left dangling.
+    is_success, file_entries = get_analyzed_file_entries(repository_name)
+    if not is_success:
+        ### An empty repository has no tree.
+        if file_entries.get("status_code") == 409:
+            os.makedirs(repo_dir, exist_ok=True)
+            return None
+        return file_entries
+
+    os.makedirs(repo_dir, exist_ok=True)
+    for path, entry in file_entries.items():
+        is_success, response = call_get_blob_api(repository_name, entry["sha"])
+        if not is_success:
+            return response
+
+        content = base64.b64decode(response.json()["content"])
+        file_path = os.path.join(repo_dir, path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        if entry["mode"] == "120000":
+            os.symlink(os.fsdecode(content), file_path)
+        else:
+            with open(file_path, "wb") as f:
+                f.write(content)
+
+    return None
+
+
+def get_git_error(e):
+    if isinstance(e, subprocess.TimeoutExpired):
+        return {"error": "Clone Timeout", "timeout": st.CLONE_TIMEOUT}
+
+    stderr = (e.stderr or b"").decode("utf-8", errors="ignore").strip()
+    return {"error": "Clone Error", "returncode": e.returncode, "stderr": stderr[-1000:]}
+
+
+def clone_with_mode(repository_name, repo_dir):
+    ### One attempt of the clone of CLONE_MODE. Returns the error, or None.
+    if st.CLONE_MODE == "API":
+        return download_repository_files(repository_name, repo_dir)
+
+    try:
+        run_git_clone(repository_name, repo_dir)
+    except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as e:
+        return get_git_error(e)
+    return None
+
+
+def replace_repository(repository_name, repo_dir, fetch):
+    ### Fetch a new copy next to the existing one and swap, so a failed refresh keeps the previous files.
+    update_dir = repo_dir + ".update"
+    shutil.rmtree(update_dir, ignore_errors=True)
+    try:
+        error = fetch(repository_name, update_dir)
+    except Exception:
+        shutil.rmtree(update_dir, ignore_errors=True)
+        raise
+    if error is not None:
+        shutil.rmtree(update_dir, ignore_errors=True)
+        return error
+
+    shutil.rmtree(repo_dir)
+    os.rename(update_dir, repo_dir)
+    return None
+
+
+def refresh_repository(repository_name, repo_dir):
+    ### The layout of the existing copy decides how it is refreshed, so copies made with another CLONE_MODE are still updated.
+    if clone_cache.is_evicted(repo_dir):
+        ### A bundle left by the clone cache has no history to fetch: clone it again with CLONE_MODE.
+        return replace_repository(repository_name, repo_dir, clone_with_mode)
+
+    if is_bare_repository(repo_dir) == False and os.path.exists(os.path.join(repo_dir, ".git")) == False:
+        ### Copy made by the API mode.
+        return replace_repository(repository_name, repo_dir, download_repository_files)
+
+    if is_bare_repository(repo_dir):
+        is_shallow = os.path.exists(os.path.join(repo_dir, "shallow"))
+    else:
+        is_shallow = os.path.exists(os.path.join(repo_dir, ".git", "shallow"))
+
+    ### Fetch only the latest commit of the default branch; shallow and blobless clones stay shallow and blobless.
+    fetch_command = ["git", "-C", repo_dir, "fetch", "origin", "HEAD"]
+    if is_shallow:
+        fetch_command[4:4] = ["--depth", "1"]
+
+    try:
+        run_git(fetch_command)
+        if is_bare_repository(repo_dir):
+            run_git(["git", "-C", repo_dir, "update-ref", "HEAD", "FETCH_HEAD"])
+        else:
+            run_git(["git", "-C", repo_dir, "reset", "--hard", "FETCH_HEAD"])
+    except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as e:
+        return get_git_error(e)
+
+    return None
+
+
+def clone_repository(repository_name, update=False):
     owner, repo = repository_name.split("/")
     owner_dir = os.path.join(st.CLONED_DIR, owner)
-    if not os.path.exists(owner_dir):
-        os.makedirs(owner_dir)
+    os.makedirs(owner_dir, exist_ok=True)
 
     repo_dir = os.path.join(owner_dir, repo)
-    if not os.path.exists(repo_dir):
-        subprocess.run([
-            "git", 
-            "clone", 
-            f"https://github.com/{repository_name}.git", 
-            repo_dir
-            ],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-            )
-        
-    return repo_dir
+    if os.path.exists(repo_dir):
+        if update == True:
+            error = refresh_repository(repository_name, repo_dir)
+            if error is not None:
+                return False, error
+        return True, repo_dir
+
+    if st.CLONE_MODE == "API":
+        ### The API client already retries failed requests.
+        try:
+            error = download_repository_files(repository_name, repo_dir)
+        except Exception:
+            shutil.rmtree(repo_dir, ignore_errors=True)
+            raise
+        if error is None:
+            return True, repo_dir
+
+        shutil.rmtree(repo_dir, ignore_errors=True)
+        return False, error
+
+    retries = 0
+    while True:
+        try:
+            run_git_clone(repository_name, repo_dir)
+            return True, repo_dir
+
+        except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as e:
+            error = get_git_error(e)
+
+        except Exception:
+            shutil.rmtree(repo_dir, ignore_errors=True)
+            raise
+
+        ### Remove the partial clone, otherwise it would be treated as cloned on the next run.
+        if os.path.exists(repo_dir):
+            shutil.rmtree(repo_dir, ignore_errors=True)
+
+        retries += 1
+        if retries > st.CLONE_MAX_RETRIES:
+            return False, error
+
+        time.sleep(st.CLONE_RETRY_DELAY)
+
+
+def check_repository(repository_name, update=False):
+    ### Any failure is recorded for this repository only, so one bad repository does not stop the month.
+    try:
+        is_success, result = clone_repository(repository_name, update)
+        if not is_success:
+            return "ERROR", result
+
+        has_workflow = check_workflow_files(result)
+        data = {"fingerprint": get_analyzed_fingerprint(result)}
+        if clone_cache.is_enabled():
+            data["size"] = clone_cache.get_directory_size(result)
+        return str(has_workflow), data
+
+    except Exception as e:
+        return "ERROR", {"error": "Unexpected Error", "type": type(e).__name__, "message": str(e)[-1000:]}
 
 
 def check_workflow_files(repo_dir):
@@ -40,16 +255,35 @@ def check_workflow_files(repo_dir):
         print(f"[Error] Repository directory not found: {repo_dir}")
         return False
 
-    workflow_files = list(Path(os.path.join(repo_dir,".github/workflows")).rglob("*.y*ml"))
+    with open_repository(repo_dir) as repository:
+        workflow_files = repository.get_manifest()["workflow_files"]
     if workflow_files:
         return True
     else:
-        # os.remove(repo_dir)
         return False
 
-def process_month(year, month):
+def get_dirty_repositories(results, previous_fingerprints):
+    ### Repositories using GitHub Actions whose analyzed files are new or changed since the previous output.
+    dirty_repositories = []
+    for repository_name in results["True"]:
+        fingerprint = results["FINGERPRINTS"].get(repository_name)
+        if fingerprint is None or previous_fingerprints.get(repository_name) != fingerprint:
+            dirty_repositories.append(repository_name)
+    return dirty_repositories
+
+
+def register_clone(repository_name, status, data, previous_fingerprints, busy_names):
+    ### Clones of repositories without workflows are not read by any later stage, so the clone cache evicts them first.
+    ### A repository is dirty as in get_dirty_repositories, and has to be consumed again before its eviction.
+    has_workflow = status == "True"
+    is_dirty = has_workflow == True and previous_fingerprints.get(repository_name) != data["fingerprint"]
+    repositories_data = {repository_name: {"has_workflow": has_workflow, "size": data.get("size")}}
+    clone_cache.register_repositories(repositories_data, [repository_name] if is_dirty else [], busy_names)
+
+
+def process_month(year, month, resume=False, update=False):
     output_path = os.path.join(st.GHA_CHECK_DIR, f"gha_check_{year}_{month}.json")
-    if st.ALLOW_OVERWRITE == False and os.path.exists(output_path) == True:
+    if st.ALLOW_OVERWRITE == False and os.path.exists(output_path) == True and update == False:
         print(f'Skip: {year}-{month}')
         return
 
@@ -67,28 +301,64 @@ def process_month(year, month):
         "ENDED_AT": None,
         "True": [],
         "False": [],
+        "ERROR": {},
+        "FINGERPRINTS": {},
+        "DIRTY": [],
     }
 
+    previous_fingerprints = {}
+    if os.path.exists(output_path) == True:
+        with open(output_path, "r") as f:
+            previous_fingerprints = json.load(f).get("FINGERPRINTS", {})
+
+    journal = Journal(os.path.join(st.JOURNAL_DIR, f"gha_check_{year}_{month}.jsonl"), resume)
+
     count = 0
-    for repository_name, workflows in tqdm.tqdm(source_data["SUCCESS"].items(),desc=f"{year}-{month}"):
+    repository_names = []
+    for repository_name, workflows in source_data["SUCCESS"].items():
         count += 1
         if st.DEBUG == True and count > st.DEBUG_DATA_NUM:
             print("\nDebug Mode: Stop after limited data")
             break
 
+        if journal.is_done(repository_name):
+            continue
+
         if workflows["total_count"] >= 1:
-            repo_dir = clone_repository(repository_name)
-            has_workflow = check_workflow_files(repo_dir)
+            repository_names.append(repository_name)
 
-            results[str(has_workflow)].append(repository_name)
+    ### Clones run in parallel; a failing or slow repository is recorded in ERROR and does not stop the month.
+    ### Each clone is registered in the clone cache as soon as it finishes, so the budget is enforced during the month;
+    ### repositories still to be cloned or refreshed are not evicted meanwhile.
+    pending_names = set(repository_names)
+    with ThreadPoolExecutor(max_workers=st.CLONE_MAX_WORKERS) as executor:
+        futures = {executor.submit(check_repository, repository_name, update): repository_name for repository_name in repository_names}
+        for future in tqdm.tqdm(as_completed(futures), total=len(futures), desc=f"{year}-{month}"):
+            repository_name = futures[future]
+            status, data = future.result()
+            journal.append(repository_name, status, data)
+            pending_names.discard(repository_name)
+            if status != "ERROR":
+                register_clone(repository_name, status, data, previous_fingerprints, pending_names)
 
-        if st.LOOP_SLEEP_TIME > 0:
-            time.sleep(st.LOOP_SLEEP_TIME)
+            if st.LOOP_SLEEP_TIME > 0:
+                time.sleep(st.LOOP_SLEEP_TIME)
     
+    journal.compact(results, source_data["SUCCESS"].keys())
+    for repository_name in results["True"] + results["False"]:
+        data = journal.get_data(repository_name)
+        if data is not None:
+            results["FINGERPRINTS"][repository_name] = data["fingerprint"]
+    results["DIRTY"] = get_dirty_repositories(results, previous_fingerprints)
+    if update == True:
+        print(f"[{year}-{month}] Update: {len(results['DIRTY'])} of {len(results['True'])} repositories changed")
+
     results["ENDED_AT"] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
     with open(output_path, "w") as f:
         json.dump(results, f, indent=4)
 
+    journal.remove()
+
 
 def generate_year_months(start, end):
     current = start
@@ -96,9 +366,9 @@ def generate_year_months(start, end):
         yield current.year, current.month
         current += relativedelta(months=1)
 
-def process_range(start_date, end_date):
+def process_range(start_date, end_date, resume=False, update=False):
     for year, month in generate_year_months(start_date, end_date):
-        process_month(year, month)
+        process_month(year, month, resume, update)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -110,12 +380,18 @@ def main():
     parser.add_argument(
         "--end", type=str, required=True, help="End year-month in format YYYY-MM (e.g., 2025-10)"
     )
+    parser.add_argument(
+        "--resume", action="store_true", help="Skip repositories already recorded in the journal of an interrupted run"
+    )
+    parser.add_argument(
+        "--update", action="store_true", help="Fetch the latest commit for already-cloned repositories and list the ones whose analyzed files changed in DIRTY"
+    )
     args = parser.parse_args()
 
     start_date = datetime.strptime(args.start, "%Y-%m")
     end_date = datetime.strptime(args.end, "%Y-%m")
 
-    process_range(start_date, end_date)
+    process_range(start_date, end_date, args.resume, args.update)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,42 @@
+import fnmatch
+import posixpath
+
+
+### Repository paths read by the analyzers.
+### The analyzers import their paths from here, and the SPARSE and API clone modes fetch exactly these paths.
+
+### Workflow files (3_clone_and_check_repository.py, 1_analyze_repository_data.py)
+WORKFLOWS_DIR = ".github/workflows"
+WORKFLOW_FILE_PATTERN = "*.y*ml"
+
+### P1: CODEOWNERS (in priority order)
+CODEOWNERS_PATHS = [".github/CODEOWNERS", "CODEOWNERS", "docs/CODEOWNERS"]
+
+### P5: Dependabot configuration
+DEPENDABOT_PATHS = [".github/dependabot.yml", ".github/dependabot.yaml"]
+
+
+def get_sparse_checkout_patterns():
+    ### Patterns for `git sparse-checkout set --no-cone` (gitignore syntax, anchored at the repository root).
+    patterns = [f"/{WORKFLOWS_DIR}/"]
+    for path in CODEOWNERS_PATHS + DEPENDABOT_PATHS:
+        patterns.append(f"/{path}")
+    return patterns
+
+
+def is_analyzed_path(path):
+    if path in CODEOWNERS_PATHS or path in DEPENDABOT_PATHS:
+        return True
+    return path.startswith(WORKFLOWS_DIR + "/") and fnmatch.fnmatchcase(posixpath.basename(path), WORKFLOW_FILE_PATTERN)
+
+
+def get_analyzed_directories():
+    ### Directories that contain the analyzed paths, parents first ("" is the repository root).
+    directories = set()
+    for path in [WORKFLOWS_DIR + "/"] + CODEOWNERS_PATHS + DEPENDABOT_PATHS:
+        directory = posixpath.dirname(path)
+        while directory != "":
+            directories.add(directory)
+            directory = posixpath.dirname(directory)
+    directories.add("")
+    return sorted(directories, key=lambda directory: (directory.count("/") + (directory != ""), directory))
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+
+import settings as st
+from modules.repository_reader import open_repository, get_analyzed_files
+
+
+### Keeps cloned_repos under CLONE_CACHE_BUDGET_GB.
+### Step 3 registers each repository as soon as it is cloned, and every stage in CLONE_CACHE_STAGES marks the repositories it has read.
+### Over the budget, repositories without workflows and then the least recently used repositories consumed by all stages
+### are shrunk in place to a bundle of only the analyzed files, so every stage (and a later run) can still read them.
+### A bundle holds EVICTED_MARKER, so that `3_clone_and_check_repository.py --update` clones it again instead of taking it
+### for a copy of the API mode.
+EVICTED_MARKER = ".clone_cache_evicted"
+
+def is_enabled():
+    return st.CLONE_CACHE_BUDGET_GB is not None
+
+
+def get_directory_size(directory):
+    size = 0
+    for root, dirs, files in os.walk(directory):
+        for name in dirs + files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return size
+
+
+def is_evicted(repo_dir):
+    return os.path.exists(os.path.join(repo_dir, EVICTED_MARKER))
+
+
+def write_analyzed_bundle(repo_dir, bundle_dir):
+    with open_repository(repo_dir) as repository:
+        for path in get_analyzed_files(repository):
+            file_path = os.path.join(bundle_dir, path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            if repository.is_symlink(path):
+                os.symlink(repository.read_link(path), file_path)
+                continue
+
+            try:
+                content = repository.read_bytes(path)
+            except OSError:
+                continue
+            with open(file_path, "wb") as f:
+                f.write(content)
+
+
+def shrink_repository(repo_dir):
+    ### Build the bundle next to the clone and swap, so an interrupted eviction never leaves a half-deleted clone.
+    bundle_dir = repo_dir + ".bundle"
+    shutil.rmtree(bundle_dir, ignore_errors=True)
+    os.makedirs(bundle_dir)
+    write_analyzed_bundle(repo_dir, bundle_dir)
+    with open(os.path.join(bundle_dir, EVICTED_MARKER), "w") as f:
+        f.write("")
+
+    shutil.rmtree(repo_dir)
+    os.rename(bundle_dir, repo_dir)
+    return get_directory_size(repo_dir)
+
+
+class CloneCache:
+    def __init__(self, index_path, budget_bytes, stages):
+        self.index_path = index_path
+        self.budget_bytes = budget_bytes
+        self.stages = stages
+
+    def update(self, apply, busy_names=()):
+        ### Several stages may run at the same time, so every change is a locked read-modify-write of the index.
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        with open(self.index_path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            repositories = self.load()
+            apply(repositories)
+            self.evict(repositories, busy_names)
+            self.save(repositories)
+
+    def load(self):
+        if os.path.exists(self.index_path) == False:
+            return {}
+
+        with open(self.index_path, "r") as f:
+            return json.load(f)
+
+    def save(self, repositories):
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(repositories, f)
+        os.replace(temp_path, self.index_path)
+
+    def register(self, repositories_data, dirty_names, busy_names=()):
+        ### repositories_data: {repository_name: {"has_workflow": bool, "size": int or None}}
+        ### Repositories that are new or changed have to be consumed again before they can be evicted.
+        ### busy_names are being cloned or refreshed and are not evicted by this update.
+        def apply(repositories):
+            now = time.time()
+            for repository_name, data in repositories_data.items():
+                entry = repositories.get(repository_name)
+                if entry is None or repository_name in dirty_names:
+                    entry = {"consumed": []}
+
+                repo_dir = os.path.join(st.CLONED_DIR, repository_name)
+                ### --update replaces an evicted bundle with a new clone.
+                entry["evicted"] = is_evicted(repo_dir)
+                entry["has_workflow"] = data["has_workflow"]
+                entry["size"] = data["size"] if data["size"] is not None else get_directory_size(repo_dir)
+                entry["last_used"] = now
+                repositories[repository_name] = entry
+
+        self.update(apply, busy_names)
+
+    def mark_consumed(self, stage, repository_names):
+        def apply(repositories):
+            now = time.time()
+            for repository_name in repository_names:
+                entry = repositories.get(repository_name)
+                if entry is None:
+                    continue
+
+                if stage not in entry["consumed"]:
+                    entry["consumed"].append(stage)
+                entry["last_used"] = now
+
+        self.update(apply)
+
+    def is_evictable(self, entry):
+        if entry["evicted"] == True:
+            return False
+        if entry["has_workflow"] == False:
+            return True
+        return all(stage in entry["consumed"] for stage in self.stages)
+
+    def evict(self, repositories, busy_names=()):
+        total_size = sum(entry["size"] for entry in repositories.values())
+        if total_size <= self.budget_bytes:
+            return
+
+        candidates = [repository_name for repository_name, entry in repositories.items() if self.is_evictable(entry) and repository_name not in busy_names]
+        candidates.sort(key=lambda repository_name: (repositories[repository_name]["has_workflow"], repositories[repository_name]["last_used"]))
+
+        for repository_name in candidates:
+            if total_size <= self.budget_bytes:
+                break
+
+            entry = repositories[repository_name]
+            repo_dir = os.path.join(st.CLONED_DIR, repository_name)
+            if os.path.exists(repo_dir) == False:
+                total_size -= entry["size"]
+                del repositories[repository_name]
+                continue
+
+            bundle_size = shrink_repository(repo_dir)
+            total_size -= entry["size"] - bundle_size
+            entry["size"] = bundle_size
+            entry["evicted"] = True
+
+        if total_size > self.budget_bytes:
+            print(f"[Warning] Clone cache is over budget: {total_size / 1024**3:.2f} GB (repositories not yet consumed by {self.stages} are kept)")
+
+
+clone_cache = None
+
+def get_clone_cache():
+    global clone_cache
+    if clone_cache is None:
+        clone_cache = CloneCache(st.CLONE_CACHE_INDEX_PATH, int(st.CLONE_CACHE_BUDGET_GB * 1024**3), st.CLONE_CACHE_STAGES)
+    return clone_cache
+
+
+def register_repositories(repositories_data, dirty_names, busy_names=()):
+    if is_enabled():
+        get_clone_cache().register(repositories_data, set(dirty_names), busy_names)
+
+
+def mark_consumed(stage, repository_names):
+    if is_enabled():
+        get_clone_cache().mark_consumed(stage, list(repository_names))
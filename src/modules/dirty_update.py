@@ -0,0 +1,57 @@
+import os
+import json
+
+### Re-analysis of only the repositories whose analyzed files changed after `3_clone_and_check_repository.py --update`.
+
+def add_only_dirty_argument(parser):
+    parser.add_argument(
+        "--only-dirty", action="store_true", help="Re-process only the repositories listed in the DIRTY section of gha_check and merge the results into the existing output"
+    )
+
+
+def select_dirty_repositories(gha_check_data):
+    ### gha_check files written before DIRTY was introduced have no fingerprints to compare, so every repository is dirty.
+    return gha_check_data.get("DIRTY", gha_check_data["True"])
+
+
+def merge_dirty_results(results, dirty_results, repository_names):
+    ### Dirty repositories take the new result and the others keep the previous one.
+    ### Repositories that are no longer in the True list of gha_check are dropped.
+    merged_results = dict(results)
+    merged_results["SUCCESS"] = {}
+    merged_results["ERROR"] = {}
+
+    for repository_name in repository_names:
+        if repository_name in dirty_results["SUCCESS"] or repository_name in dirty_results["ERROR"]:
+            source_results = dirty_results
+        else:
+            source_results = results
+
+        for section in ["SUCCESS", "ERROR"]:
+            if repository_name in source_results[section]:
+                merged_results[section][repository_name] = source_results[section][repository_name]
+
+    return merged_results
+
+
+def load_dirty_selection(output_path, gha_check_data, year, month):
+    ### --only-dirty: (repository_names, previous_results) with the dirty repositories and the existing output to merge into,
+    ### or None when there is no output yet (every repository is processed).
+    if os.path.exists(output_path) == False:
+        return None
+
+    with open(output_path, "r") as f:
+        previous_results = json.load(f)
+
+    repository_names = select_dirty_repositories(gha_check_data)
+    print(f"[{year}-{month}] Update: {len(repository_names)} of {len(gha_check_data['True'])} repositories changed")
+    return repository_names, previous_results
+
+
+def apply_dirty_results(previous_results, results, repository_names):
+    ### merge_dirty_results, recording UPDATED_AT in outputs with ENDED_AT.
+    ended_at = results.get("ENDED_AT")
+    results = merge_dirty_results(previous_results, results, repository_names)
+    if ended_at is not None:
+        results["UPDATED_AT"] = ended_at
+    return results
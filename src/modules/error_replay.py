@@ -0,0 +1,112 @@
+import os
+import json
+
+import settings as st
+from modules.dirty_update import load_dirty_selection, apply_dirty_results
+
+
+def add_retry_error_arguments(parser):
+    parser.add_argument(
+        "--retry-errors", action="store_true", help="Re-process only the repositories in the ERROR section of the existing output and merge the results in place"
+    )
+    parser.add_argument(
+        "--error-status", type=int, nargs="+", default=None, help="With --retry-errors, only retry errors with these HTTP status codes (e.g., 403 502)"
+    )
+    parser.add_argument(
+        "--error-type", type=str, nargs="+", default=None, help="With --retry-errors, only retry errors of these types (e.g., \"Network Error\")"
+    )
+
+
+def get_retry_filter(args):
+    if args.retry_errors == False:
+        return None
+
+    return {
+        "status_codes": args.error_status,
+        "error_types": args.error_type
+    }
+
+
+def get_error_type(error):
+    ### Errors are either {"error": ..., "status_code": ...} (API stages) or a plain message (analysis stages).
+    if isinstance(error, dict):
+        return error.get("error")
+    return error
+
+
+def select_error_repositories(errors, retry_filter):
+    repository_names = []
+    for repository_name, error in errors.items():
+        if retry_filter["status_codes"] is not None:
+            if not isinstance(error, dict) or error.get("status_code") not in retry_filter["status_codes"]:
+                continue
+
+        if retry_filter["error_types"] is not None:
+            if get_error_type(error) not in retry_filter["error_types"]:
+                continue
+
+        repository_names.append(repository_name)
+
+    return repository_names
+
+
+def merge_retry_results(results, retry_results):
+    ### Successes move from ERROR to SUCCESS, repositories that failed again keep their latest error.
+    for repository_name, data in retry_results["SUCCESS"].items():
+        results["ERROR"].pop(repository_name, None)
+        results["SUCCESS"][repository_name] = data
+
+    for repository_name, error in retry_results["ERROR"].items():
+        results["ERROR"][repository_name] = error
+
+    return results
+
+
+def get_journal_path(journal_prefix, year, month, tag=None):
+    if journal_prefix is None:
+        return None
+    if tag is not None:
+        journal_prefix = f"{journal_prefix}_{tag}"
+    return os.path.join(st.JOURNAL_DIR, f"{journal_prefix}_{year}_{month}.jsonl")
+
+
+def select_repositories(output_path, gha_check_data, retry_filter, only_dirty, year, month, journal_prefix=None):
+    ### Repositories to process in a month of an analysis stage, with --retry-errors or --only-dirty applied.
+    ### Returns (repository_names, previous_results, journal_path), or None when there is no output to retry.
+    ### previous_results is the existing output to merge into with merge_previous_results (None for a full run), and
+    ### journal_path is the journal of this kind of run (None without journal_prefix).
+    if retry_filter is not None:
+        if os.path.exists(output_path) == False:
+            print(f"[Error] File not found: {output_path}")
+            return None
+
+        with open(output_path, "r") as f:
+            previous_results = json.load(f)
+
+        repository_names = select_error_repositories(previous_results["ERROR"], retry_filter)
+        print(f"[{year}-{month}] Retry: {len(repository_names)} of {len(previous_results['ERROR'])} errored repositories")
+        return repository_names, previous_results, get_journal_path(journal_prefix, year, month, "retry")
+
+    if only_dirty == True:
+        dirty_selection = load_dirty_selection(output_path, gha_check_data, year, month)
+        if dirty_selection is not None:
+            repository_names, previous_results = dirty_selection
+            return repository_names, previous_results, get_journal_path(journal_prefix, year, month, "dirty")
+
+    return gha_check_data["True"], None, get_journal_path(journal_prefix, year, month)
+
+
+def merge_previous_results(previous_results, results, retry_filter, repository_names):
+    ### Merges the results of a run selected by select_repositories into previous_results.
+    ### repository_names: the True list of gha_check. Outputs with ENDED_AT also record RETRIED_AT or UPDATED_AT.
+    if previous_results is None:
+        return results
+
+    if retry_filter is None:
+        return apply_dirty_results(previous_results, results, repository_names)
+
+    ended_at = results.get("ENDED_AT")
+    results = merge_retry_results(previous_results, results)
+    if ended_at is not None:
+        results["RETRIED_AT"] = ended_at
+    return results
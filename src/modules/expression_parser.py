@@ -0,0 +1,135 @@
+import re
+from functools import lru_cache
+
+
+### Lexer for GitHub Actions expressions (`${{ ... }}`).
+### get_context_paths returns the context paths an expression refers to, e.g. "github.event.issue.title" for
+### `${{ github.event.issue.title }}` or `${{ toJSON(github.event['issue'].title) }}`. Text outside `${{ }}` (shell code,
+### comments, plain strings) is not an expression and gives no path.
+### Results are cached by string, since the same run scripts and with blocks appear in many repositories.
+
+EXPRESSION_START = "${{"
+EXPRESSION_END = "}}"
+TOKEN_PATTERN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<number>[-+]?(?:0x[0-9A-Fa-f]+|0o[0-7]+|(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?))
+  | (?P<name>[A-Za-z_][A-Za-z0-9_-]*)
+  | (?P<operator>==|!=|<=|>=|&&|\|\||[<>!()\[\].,*])
+  | (?P<end>}})
+""", re.VERBOSE)
+KEYWORDS = {"true", "false", "null"}
+### Property index for anything but a string literal (`[0]`, `[matrix.key]`, ...).
+ANY_PROPERTY = "*"
+
+
+class Token:
+    def __init__(self, kind, value):
+        self.kind = kind
+        self.value = value
+
+
+def tokenize(text, position=0):
+    ### Tokens of the expression starting at position, up to the closing "}}" (or the end of text).
+    ### Returns (tokens, end position, closed). Characters that are not part of the syntax are skipped.
+    tokens = []
+    while position < len(text):
+        m = TOKEN_PATTERN.match(text, position)
+        if m is None:
+            position += 1
+            continue
+
+        position = m.end()
+        if m.lastgroup == "end":
+            return tokens, position, True
+        if m.lastgroup != "space":
+            tokens.append(Token(m.lastgroup, m.group(0)))
+
+    return tokens, position, False
+
+
+@lru_cache(maxsize=100000)
+def get_expressions(text):
+    ### Token lists of every closed `${{ }}` in text.
+    expressions = []
+    position = text.find(EXPRESSION_START)
+    while position != -1:
+        tokens, position, closed = tokenize(text, position + len(EXPRESSION_START))
+        if closed == False:
+            break
+        expressions.append(tokens)
+        position = text.find(EXPRESSION_START, position)
+
+    return tuple(expressions)
+
+
+@lru_cache(maxsize=100000)
+def get_expression_sources(text):
+    ### Source text of every closed `${{ }}` in text, without the delimiters.
+    sources = []
+    position = text.find(EXPRESSION_START)
+    while position != -1:
+        start = position + len(EXPRESSION_START)
+        tokens, position, closed = tokenize(text, start)
+        if closed == False:
+            break
+        sources.append(text[start:position - len(EXPRESSION_END)])
+        position = text.find(EXPRESSION_START, position)
+
+    return tuple(sources)
+
+
+def find_closing_bracket(tokens, start):
+    depth = 0
+    for index in range(start, len(tokens)):
+        if tokens[index].value == "[":
+            depth += 1
+        elif tokens[index].value == "]":
+            depth -= 1
+            if depth == 0:
+                return index
+    return len(tokens)
+
+
+def read_path(tokens, start):
+    ### The path starting at the name tokens[start]: following `.name`, `.*` and `[...]` are properties.
+    properties = [tokens[start].value]
+    index = start + 1
+    while index < len(tokens):
+        token = tokens[index]
+        if token.value == "." and index + 1 < len(tokens) and (tokens[index + 1].kind == "name" or tokens[index + 1].value == "*"):
+            properties.append(tokens[index + 1].value)
+            index += 2
+        elif token.value == "[":
+            end = find_closing_bracket(tokens, index)
+            if end == index + 2 and tokens[index + 1].kind == "string":
+                properties.append(tokens[index + 1].value[1:-1].replace("''", "'"))
+            else:
+                properties.append(ANY_PROPERTY)
+            index = end + 1
+        else:
+            break
+
+    return ".".join(properties)
+
+
+@lru_cache(maxsize=100000)
+def get_context_paths(text):
+    ### Context paths referred to by the expressions in text, in order of appearance and without duplicates.
+    ### Function names (`contains(...)`) and the literals true, false and null are not paths. Names inside an index
+    ### (`matrix.config[matrix.key]`) start paths of their own.
+    paths = []
+    for tokens in get_expressions(text):
+        for index, token in enumerate(tokens):
+            if token.kind != "name" or token.value in KEYWORDS:
+                continue
+            if index > 0 and tokens[index - 1].value == ".":
+                continue
+            if index + 1 < len(tokens) and tokens[index + 1].value == "(":
+                continue
+
+            path = read_path(tokens, index)
+            if path not in paths:
+                paths.append(path)
+
+    return tuple(paths)
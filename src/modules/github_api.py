@@ -1,10 +1,15 @@
 import jwt
+import random
 import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException, ConnectionError
 
 import settings as st
+from modules.response_cache import ResponseCache
 
 
 def generate_jwt(config):
@@ -19,23 +24,49 @@ def generate_jwt(config):
 
     return jwt.encode(payload, private_key, algorithm="RS256")
 
-def get_access_token():
-    if st.TOKEN_MODE == "GITHUB_APP_TOKEN":
-        jwt_token = generate_jwt(st.GITHUB_APP_CONFIG)
+def get_credential_configs():
+    if st.TOKEN_MODE == "TOKEN_POOL":
+        return st.TOKEN_POOL
+
+    elif st.TOKEN_MODE == "GITHUB_APP_TOKEN":
+        return [{"TOKEN_MODE": "GITHUB_APP_TOKEN", "GITHUB_APP_CONFIG": st.GITHUB_APP_CONFIG}]
+
+    elif st.TOKEN_MODE == "PERSONAL_ACCESS_TOKEN":
+        return [{"TOKEN_MODE": "PERSONAL_ACCESS_TOKEN", "PERSONAL_ACCESS_TOKEN": st.PERSONAL_ACCESS_TOKEN}]
+
+
+def request_access_token(credential_config):
+    if credential_config["TOKEN_MODE"] == "GITHUB_APP_TOKEN":
+        app_config = credential_config["GITHUB_APP_CONFIG"]
+        jwt_token = generate_jwt(app_config)
         headers = {
             "Authorization": f"Bearer {jwt_token}",
             "Accept": "application/vnd.github.v3+json"
         }
 
         response = requests.post(
-            f'https://api.github.com/app/installations/{st.GITHUB_APP_CONFIG["INSTALLATION_ID"]}/access_tokens', 
+            f'https://api.github.com/app/installations/{app_config["INSTALLATION_ID"]}/access_tokens', 
             headers=headers
             )
         data = response.json()
         return data["token"], data["expires_at"]
     
-    elif st.TOKEN_MODE == "PERSONAL_ACCESS_TOKEN":
-        return st.PERSONAL_ACCESS_TOKEN, None
+    elif credential_config["TOKEN_MODE"] == "PERSONAL_ACCESS_TOKEN":
+        return credential_config["PERSONAL_ACCESS_TOKEN"], None
+
+
+TOKEN_EXPIRY_MARGIN = 60
+
+def is_token_expired(expires_at, margin_seconds=0):
+    if expires_at is None:
+        return False
+
+    expires_at_utc = datetime.strptime(expires_at, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) >= expires_at_utc - timedelta(seconds=margin_seconds)
+
+
+def get_access_token():
+    return get_token_pool().select().get_token()
     
 
 def get_rate_limit(response):
@@ -48,43 +79,299 @@ def get_rate_limit(response):
     return limit_num, remaining, reset_time_utc
 
 
-def request_github_api(api_url, access_token):
-    headers = {
-        "Authorization": f"token {access_token}",
-        "Content-Type": "application/json",
-        "X-GitHub-Api-Version": "2022-11-28"
-    }
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+
+class RateLimitScheduler:
+    ### Paces requests of all worker threads from the X-RateLimit-* headers of the latest responses.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.limit_num = None
+        self.remaining = None
+        self.reset_time = None
+        self.next_request_time = 0
+        self.blocked_until = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.time()
+            request_time = max(now, self.next_request_time, self.blocked_until)
+
+            if self.remaining is not None and self.reset_time > now:
+                budget = self.remaining - st.API_RATE_LIMIT_RESERVE
+                if budget <= 0:
+                    ### Budget used up: wait for the reset instead of hitting the primary rate limit.
+                    request_time = max(request_time, self.reset_time + 1)
+                elif self.remaining < int(self.limit_num) * st.API_PACING_THRESHOLD:
+                    ### Spread the remaining budget evenly until the reset.
+                    self.next_request_time = request_time + (self.reset_time - now) / budget
+
+                self.remaining -= 1
+
+        if request_time > now:
+            time.sleep(request_time - now)
+
+    def update(self, response):
+        limit_num = response.headers.get("X-RateLimit-Limit")
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset_time = response.headers.get("X-RateLimit-Reset")
+        if limit_num is None or remaining is None or reset_time is None:
+            return
+
+        with self.lock:
+            if self.reset_time == int(reset_time):
+                ### Responses of concurrent requests arrive out of order, so keep the smallest value.
+                self.remaining = min(self.remaining, int(remaining))
+            else:
+                self.remaining = int(remaining)
+
+            self.limit_num = int(limit_num)
+            self.reset_time = int(reset_time)
+
+    def block(self, seconds):
+        ### Secondary rate limits apply to the whole credential, so pause every worker.
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.time() + seconds)
+
+    def get_available(self):
+        with self.lock:
+            now = time.time()
+            if self.blocked_until > now:
+                return -1
+            if self.remaining is None or self.reset_time <= now:
+                return float("inf")
+            return self.remaining
+
+
+class Credential:
+    ### One PAT or GitHub App installation with its own rate limit state.
+    def __init__(self, credential_config=None, access_token=None):
+        self.credential_config = credential_config
+        self.access_token = access_token
+        self.expires_at = None
+        self.lock = threading.Lock()
+        self.refresh_thread = None
+        self.schedulers = {}
+
+    def get_scheduler(self, resource="core"):
+        ### REST ("core") and GraphQL requests are counted against separate rate limits.
+        with self.lock:
+            if resource not in self.schedulers:
+                self.schedulers[resource] = RateLimitScheduler()
+            return self.schedulers[resource]
+
+    def get_token(self):
+        ### Installation tokens are reused until API_TOKEN_REFRESH_MARGIN seconds before expires_at,
+        ### then refreshed in the background while the current token keeps being served.
+        with self.lock:
+            if self.credential_config is None:
+                return self.access_token, self.expires_at
+
+            if self.access_token is None or is_token_expired(self.expires_at, TOKEN_EXPIRY_MARGIN):
+                self.access_token, self.expires_at = request_access_token(self.credential_config)
+
+            elif is_token_expired(self.expires_at, st.API_TOKEN_REFRESH_MARGIN) and self.refresh_thread is None:
+                self.refresh_thread = threading.Thread(target=self.refresh_token, daemon=True)
+                self.refresh_thread.start()
 
-    retries = 0
-    while retries <= st.API_MAX_RETRIES:
+            return self.access_token, self.expires_at
+
+    def refresh_token(self):
         try:
-            response = requests.get(
-                url = api_url,
-                headers = headers
-            )
+            access_token, expires_at = request_access_token(self.credential_config)
+            with self.lock:
+                self.access_token, self.expires_at = access_token, expires_at
+
+        except Exception as e:
+            print(f"\n[WARNING] Failed to refresh access token in background: {e}")
+
+        finally:
+            with self.lock:
+                self.refresh_thread = None
+
+    def invalidate_token(self):
+        with self.lock:
+            if self.credential_config is not None:
+                self.access_token = None
+
+
+class TokenPool:
+    ### Rotates requests to the credential with the most remaining rate limit.
+    def __init__(self, credential_configs):
+        self.credentials = [Credential(credential_config) for credential_config in credential_configs]
+        self.lock = threading.Lock()
+        self.given_credentials = {}
+
+    def select(self, resource="core"):
+        return max(self.credentials, key=lambda credential: credential.get_scheduler(resource).get_available())
+
+    def get_credential(self, access_token):
+        ### Tokens given by the caller are not rotated, but still get their own rate limit state.
+        with self.lock:
+            if access_token not in self.given_credentials:
+                self.given_credentials[access_token] = Credential(access_token=access_token)
+            return self.given_credentials[access_token]
+
+
+token_pool = None
+
+def get_token_pool():
+    global token_pool
+    if token_pool is None:
+        token_pool = TokenPool(get_credential_configs())
+    return token_pool
+
+
+def get_backoff_seconds(retries):
+    return st.API_RETRY_DELAY * (2 ** retries) * random.uniform(0.5, 1.5)
+
 
-            if response.status_code == 200:
-                return True, response
+def get_retry_seconds(response, retries):
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is not None and retry_after.isdigit():
+        return int(retry_after)
+
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        reset_time = response.headers.get("X-RateLimit-Reset")
+        if reset_time is not None:
+            return max(int(reset_time) - time.time(), 0) + 1
+
+    return get_backoff_seconds(retries)
+
+
+def is_rate_limited(response):
+    if response.status_code == 429:
+        return True
+
+    if response.status_code == 403:
+        if response.headers.get("Retry-After") is not None or response.headers.get("X-RateLimit-Remaining") == "0":
+            return True
+        if "secondary rate limit" in response.text.lower():
+            return True
+
+    return False
+
+
+class GitHubAPIClient:
+    ### Keeps one keep-alive connection pool and one bounded worker pool for all API calls in the process.
+    def __init__(self, max_workers=None):
+        if max_workers is None:
+            max_workers = st.API_MAX_WORKERS
+
+        self.max_workers = max_workers
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        if st.API_CACHE_ENABLED == True:
+            self.response_cache = ResponseCache(st.API_CACHE_DIR)
+        else:
+            self.response_cache = None
+
+    def get(self, api_url, access_token=None):
+        return self.request("GET", api_url, access_token)
+
+    def post(self, api_url, json_data, access_token=None, resource="core"):
+        return self.request("POST", api_url, access_token, json_data, resource)
+
+    def request(self, method, api_url, access_token=None, json_data=None, resource="core"):
+        cache_entry = None
+        if self.response_cache is not None and method == "GET":
+            cache_entry = self.response_cache.load(api_url)
+
+        retries = 0
+        while retries <= st.API_MAX_RETRIES:
+            if access_token is None:
+                credential = get_token_pool().select(resource)
             else:
+                credential = get_token_pool().get_credential(access_token)
+            scheduler = credential.get_scheduler(resource)
+
+            scheduler.wait()
+            try:
+                token, expires_at = credential.get_token()
+                headers = {
+                    "Authorization": f"token {token}",
+                    "Content-Type": "application/json",
+                    "X-GitHub-Api-Version": "2022-11-28"
+                }
+                if cache_entry is not None:
+                    headers.update(self.response_cache.get_conditional_headers(cache_entry))
+
+                response = self.session.request(
+                    method = method,
+                    url = api_url,
+                    headers = headers,
+                    json = json_data
+                )
+                scheduler.update(response)
+
+                if response.status_code == 200:
+                    if self.response_cache is not None and method == "GET":
+                        self.response_cache.store(api_url, response)
+                    return True, response
+
+                if response.status_code == 304 and cache_entry is not None:
+                    return True, self.response_cache.build_response(cache_entry, response)
+
+                if response.status_code == 401 and credential.credential_config is not None and retries < st.API_MAX_RETRIES:
+                    ### The installation token was revoked or expired early, so get a new one.
+                    credential.invalidate_token()
+                    retries += 1
+                    continue
+
+                if is_rate_limited(response) or response.status_code in RETRYABLE_STATUS_CODES:
+                    if retries < st.API_MAX_RETRIES:
+                        retry_seconds = get_retry_seconds(response, retries)
+                        if is_rate_limited(response):
+                            scheduler.block(retry_seconds)
+                        else:
+                            time.sleep(retry_seconds)
+                        retries += 1
+                        continue
+
                 # print(f"Error: {api_url} Status Code: {response.status_code}")
                 return False, {"error": "API Error", "status_code": response.status_code, "response": response.text}
 
-        except (RequestException, ConnectionError) as e:
-            # print(f'\nSleep : {api_url} for NetWork Error')
-            time.sleep(st.API_RETRY_DELAY)
-            retries += 1
-            if retries > st.API_MAX_RETRIES:
-                print(f'\nNetwork Error: {api_url} {e}')
-                return False, {"error": "Network Error"}
-        
-        except Exception as e:
-            # print(f'\nSleep : {api_url} for Other Error')
-            time.sleep(st.API_RETRY_DELAY)
-            retries += 1
+            except (RequestException, ConnectionError) as e:
+                # print(f'\nSleep : {api_url} for NetWork Error')
+                time.sleep(get_backoff_seconds(retries))
+                retries += 1
+                if retries > st.API_MAX_RETRIES:
+                    print(f'\nNetwork Error: {api_url} {e}')
+                    return False, {"error": "Network Error"}
+
+            except Exception as e:
+                # print(f'\nSleep : {api_url} for Other Error')
+                time.sleep(get_backoff_seconds(retries))
+                retries += 1
+
+                if retries > st.API_MAX_RETRIES:
+                    print(f"\nError: {api_url} {e}")
+                    return False, {"error": str(e)}
+
+    def map(self, func, items):
+        ### Results are returned in the same order as items.
+        return list(self.executor.map(func, items))
+
+
+client = None
+
+def get_client():
+    global client
+    if client is None:
+        client = GitHubAPIClient()
+    return client
+
+
+def request_github_api(api_url, access_token=None):
+    return get_client().get(api_url, access_token)
+
 
-            if retries > st.API_MAX_RETRIES:
-                print(f"\nError: {api_url} {e}")
-                return False, {"error": str(e)}
+def call_api_batch(api_caller, repository_names, access_token=None):
+    ### Submit one call_*_api helper for many repositories to the worker pool.
+    return get_client().map(lambda repository_name: api_caller(repository_name, access_token), repository_names)
 
 
 # [ToDo] This part is under development
@@ -105,21 +392,195 @@ def request_github_api(api_url, access_token):
 #         return False, None
 
 
-def call_workflows_api(repository_name, access_token):
+def call_workflows_api(repository_name, access_token=None):
     api_url = f'https://api.github.com/repos/{repository_name}/actions/workflows'
     return request_github_api(api_url, access_token)
 
 
-def call_get_repository_tags_api(repository_name, access_token, page_id = 1):
+def call_get_repository_tags_api(repository_name, access_token=None, page_id = 1):
     api_url = f'https://api.github.com/repos/{repository_name}/tags?per_page=100&page={page_id}'
     return request_github_api(api_url, access_token)
 
 
-def call_get_repository_branches_api(repository_name, access_token, page_id = 1):
+def call_get_repository_branches_api(repository_name, access_token=None, page_id = 1):
     api_url = f'https://api.github.com/repos/{repository_name}/branches?per_page=100&page={page_id}'
     return request_github_api(api_url, access_token)
 
 
-def call_get_repository_api(repository_name, access_token):
+def call_get_repository_api(repository_name, access_token=None):
     api_url = f'https://api.github.com/repos/{repository_name}'
-    return request_github_api(api_url, access_token)
\ No newline at end of file
+    return request_github_api(api_url, access_token)
+
+
+def call_get_tree_api(repository_name, tree_sha, recursive=False, access_token=None):
+    api_url = f'https://api.github.com/repos/{repository_name}/git/trees/{tree_sha}'
+    if recursive == True:
+        api_url += '?recursive=1'
+    return request_github_api(api_url, access_token)
+
+
+def call_get_blob_api(repository_name, blob_sha, access_token=None):
+    api_url = f'https://api.github.com/repos/{repository_name}/git/blobs/{blob_sha}'
+    return request_github_api(api_url, access_token)
+
+def get_rate_limit_status(resource="core"):
+    scheduler = get_token_pool().select(resource).get_scheduler(resource)
+    if scheduler.reset_time is None:
+        return scheduler.limit_num, scheduler.remaining, datetime.now(timezone.utc)
+
+    return scheduler.limit_num, scheduler.remaining, datetime.fromtimestamp(scheduler.reset_time, tz=timezone.utc)
+
+
+### GraphQL backend: many repositories are aliased into one query (r0, r1, ...).
+GRAPHQL_WORKFLOWS_FIELDS = """
+    object(expression: "HEAD:.github/workflows") {
+        ... on Tree { entries { name path type } }
+    }
+"""
+
+GRAPHQL_REFS_FIELDS = """
+    refs(refPrefix: $prefix{index}, first: 100, after: $cursor{index}) {
+        pageInfo { hasNextPage endCursor }
+        nodes { name target { oid ... on Tag { target { oid } } } }
+    }
+"""
+
+GRAPHQL_REF_PREFIXES = {
+    "tags": "refs/tags/",
+    "branches": "refs/heads/"
+}
+
+
+def request_github_graphql_api(query, variables, access_token=None):
+    is_success, result = get_client().post(st.GITHUB_GRAPHQL_URL, {"query": query, "variables": variables}, access_token, resource="graphql")
+    if not is_success:
+        return False, result
+
+    data = result.json()
+    if data.get("data") is None:
+        return False, {"error": "GraphQL Error", "response": data.get("errors")}
+
+    return True, data
+
+
+def get_graphql_alias_errors(data):
+    alias_errors = {}
+    for error in data.get("errors") or []:
+        path = error.get("path") or []
+        if len(path) > 0:
+            alias_errors[path[0]] = error.get("message")
+    return alias_errors
+
+
+def build_graphql_repository_query(repository_names, fields, extra_variable_types=None):
+    extra_variable_types = extra_variable_types or {}
+    variable_definitions = []
+    aliases = []
+    variables = {}
+    for index, repository_name in enumerate(repository_names):
+        owner, name = repository_name.split("/")[0:2]
+        variables[f"owner{index}"] = owner
+        variables[f"name{index}"] = name
+        variable_definitions.append(f"$owner{index}: String!, $name{index}: String!")
+        for variable_name, variable_type in extra_variable_types.items():
+            variable_definitions.append(f"${variable_name}{index}: {variable_type}")
+
+        aliases.append(f"r{index}: repository(owner: $owner{index}, name: $name{index}) {{ {fields.replace('{index}', str(index))} }}")
+
+    query = f"query({', '.join(variable_definitions)}) {{ {' '.join(aliases)} }}"
+    return query, variables
+
+
+def call_workflows_graphql_api(repository_names, access_token=None):
+    ### Returns the same shape as the REST workflows API ({"total_count": ..., "workflows": [...]}) per repository.
+    ### GraphQL has no Actions workflows, so the files under .github/workflows are listed instead: a row only has the
+    ### "path" of the REST rows (no id, display name or state).
+    query, variables = build_graphql_repository_query(repository_names, GRAPHQL_WORKFLOWS_FIELDS)
+    is_success, result = request_github_graphql_api(query, variables, access_token)
+    if not is_success:
+        return [(False, result) for _ in repository_names]
+
+    alias_errors = get_graphql_alias_errors(result)
+    results = []
+    for index, repository_name in enumerate(repository_names):
+        repository_data = result["data"].get(f"r{index}")
+        if repository_data is None:
+            results.append((False, {"error": "GraphQL Error", "response": alias_errors.get(f"r{index}")}))
+            continue
+
+        workflows = []
+        for entry in (repository_data.get("object") or {}).get("entries", []):
+            if entry["type"] == "blob" and entry["name"].endswith((".yml", ".yaml")):
+                workflows.append({"path": entry["path"]})
+
+        results.append((True, {"total_count": len(workflows), "workflows": workflows}))
+
+    return results
+
+
+def call_workflows_graphql_api_batch(repository_names, access_token=None):
+    chunks = [repository_names[i:i + st.GRAPHQL_BATCH_SIZE] for i in range(0, len(repository_names), st.GRAPHQL_BATCH_SIZE)]
+    chunk_results = get_client().map(lambda chunk: call_workflows_graphql_api(chunk, access_token), chunks)
+    return [result for chunk_result in chunk_results for result in chunk_result]
+
+
+def call_refs_graphql_api(ref_requests, access_token=None):
+    ### ref_requests: list of (repository_name, "tags" or "branches", cursor)
+    repository_names = [repository_name for repository_name, ref_type, cursor in ref_requests]
+    query, variables = build_graphql_repository_query(repository_names, GRAPHQL_REFS_FIELDS, {"prefix": "String!", "cursor": "String"})
+    for index, (repository_name, ref_type, cursor) in enumerate(ref_requests):
+        variables[f"prefix{index}"] = GRAPHQL_REF_PREFIXES[ref_type]
+        variables[f"cursor{index}"] = cursor
+
+    is_success, result = request_github_graphql_api(query, variables, access_token)
+    if not is_success:
+        return [(False, result) for _ in ref_requests]
+
+    alias_errors = get_graphql_alias_errors(result)
+    results = []
+    for index in range(len(ref_requests)):
+        repository_data = result["data"].get(f"r{index}")
+        if repository_data is None or repository_data.get("refs") is None:
+            results.append((False, {"error": "GraphQL Error", "response": alias_errors.get(f"r{index}")}))
+            continue
+
+        ### Same fields as the REST tags / branches APIs that are used by the analysis. refs() lists them in alphabetical
+        ### order, which may differ from the order of the REST APIs.
+        ref_list = []
+        for node in repository_data["refs"]["nodes"]:
+            target = node["target"]
+            sha = target["target"]["oid"] if "target" in target else target["oid"]
+            ref_list.append({"name": node["name"], "commit": {"sha": sha}})
+
+        results.append((True, (ref_list, repository_data["refs"]["pageInfo"])))
+
+    return results
+
+
+def get_repository_refs_graphql(repository_names, access_token=None):
+    refs_data = {}
+    pending_requests = []
+    for repository_name in repository_names:
+        refs_data[repository_name] = {}
+        for ref_type in GRAPHQL_REF_PREFIXES:
+            refs_data[repository_name][ref_type] = {"is_success": True, "data": []}
+            pending_requests.append((repository_name, ref_type, None))
+
+    ### Repositories with more than 100 refs are paged in the following rounds.
+    while pending_requests:
+        chunks = [pending_requests[i:i + st.GRAPHQL_BATCH_SIZE] for i in range(0, len(pending_requests), st.GRAPHQL_BATCH_SIZE)]
+        chunk_results = get_client().map(lambda chunk: call_refs_graphql_api(chunk, access_token), chunks)
+
+        pending_requests = []
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            for (repository_name, ref_type, cursor), (is_success, result) in zip(chunk, chunk_result):
+                if not is_success:
+                    refs_data[repository_name][ref_type] = {"is_success": False, "data": result}
+                    continue
+
+                ref_list, page_info = result
+                refs_data[repository_name][ref_type]["data"].extend(ref_list)
+                if page_info["hasNextPage"]:
+                    pending_requests.append((repository_name, ref_type, page_info["endCursor"]))
+
+    return refs_data
@@ -1,7 +1,174 @@
 import re
+import math
+import itertools
 from pathlib import Path
+from functools import lru_cache
+
+import settings as st
+
+from modules.injection_rules import RULE_PATTERN, match_rules, match_env_rules
+from modules.expression_parser import get_context_paths
 
 CONTEXT_SIGNATURE = "github.event."
+MATRIX_PATTERN = re.compile(r'(?<![A-Za-z0-9_.])matrix\.[A-Za-z0-9_-]+(?:\.[A-Za-z0-9_-]+)*')
+
+
+class WorkflowIndex:
+    ### Built once per workflow by get_context_data, so that no part of the workflow is serialized or walked twice.
+    ### texts: str() of each mapping and sequence, computed on first use (several env keys are looked up in the same
+    ### step, and aliased subtrees are shared between steps).
+    ### matrix_paths: every (position, path, node) of matrix_walk over a job's strategy, indexed by path, so the matrix
+    ### is walked once per job instead of once per step that refers to it.
+    def __init__(self):
+        self.texts = {}
+        self.matrix_paths = {}
+        self.matrix_models = {}
+
+    def get_text(self, node):
+        if isinstance(node, str):
+            return node
+        if not isinstance(node, (dict, list)):
+            return str(node)
+
+        text = self.texts.get(id(node))
+        if text is None:
+            text = str(node)
+            self.texts[id(node)] = text
+        return text
+
+    def get_matrix_paths(self, job_data):
+        matrix_paths = self.matrix_paths.get(id(job_data))
+        if matrix_paths is None:
+            matrix_paths = {}
+            for position, (norm, node) in enumerate(walk_matrix_paths(job_data.get('strategy') or {})):
+                matrix_paths.setdefault(norm, []).append((position, norm, node))
+            self.matrix_paths[id(job_data)] = matrix_paths
+        return matrix_paths
+
+    def get_matrix_model(self, job_data):
+        matrix_model = self.matrix_models.get(id(job_data))
+        if matrix_model is None:
+            matrix_model = MatrixModel(job_data.get('strategy') or {})
+            self.matrix_models[id(job_data)] = matrix_model
+        return matrix_model
+
+    def has_signature(self, matrix_list):
+        ### Same as CONTEXT_SIGNATURE in str(matrix_list): the signature has no quotes, spaces or brackets, so it can only
+        ### appear inside one path or one value of the list.
+        for matrix in matrix_list:
+            for p, v in matrix.items():
+                if CONTEXT_SIGNATURE in p or CONTEXT_SIGNATURE in self.get_text(v):
+                    return True
+        return False
+
+
+class MatrixModel:
+    ### The values each matrix.<key> of a job can take, following the expansion of GitHub Actions: the cross product of
+    ### the listed values, without the combinations matched by exclude, then include (added to every combination whose
+    ### original values it matches, or as a new combination).
+    ### dynamic_values: parts that are expressions instead of lists (e.g. `matrix: ${{ fromJSON(...) }}`), and may give any key.
+    ### Matrices over MATRIX_MAX_COMBINATIONS are not expanded (truncated): every listed and included value of a key is kept.
+    def __init__(self, strategy):
+        self.values = {}
+        self.dynamic_values = []
+        self.truncated = False
+
+        matrix = strategy.get("matrix") if isinstance(strategy, dict) else strategy
+        if matrix is None:
+            return
+        if not isinstance(matrix, dict):
+            self.dynamic_values.append(matrix)
+            return
+
+        options = {}
+        for key, value in matrix.items():
+            if key not in ("include", "exclude"):
+                options[key] = value if isinstance(value, list) else [value]
+
+        include = self.get_entries(matrix.get("include"))
+        exclude = self.get_entries(matrix.get("exclude"))
+
+        if math.prod(len(value) for value in options.values()) > st.MATRIX_MAX_COMBINATIONS:
+            self.truncated = True
+            for key, value in options.items():
+                self.values[key] = list(value)
+            for entry in include:
+                for key, value in entry.items():
+                    self.values.setdefault(key, []).append(value)
+            return
+
+        combinations = []
+        if options != {}:
+            for values in itertools.product(*options.values()):
+                combination = dict(zip(options.keys(), values))
+                if not any(match_matrix_entry(combination, entry) for entry in exclude):
+                    combinations.append(combination)
+
+        original_count = len(combinations)
+        for entry in include:
+            added = False
+            for combination in combinations[:original_count]:
+                if all(key not in options or combination[key] == value for key, value in entry.items()):
+                    combination.update({key: value for key, value in entry.items() if key not in options})
+                    added = True
+            if added == False:
+                combinations.append(dict(entry))
+
+        for combination in combinations:
+            for key, value in combination.items():
+                self.values.setdefault(key, []).append(value)
+
+    def get_entries(self, entries):
+        ### The mappings of include or exclude. Anything else is an expression, kept as a dynamic value.
+        if entries is None:
+            return []
+        if not isinstance(entries, list):
+            self.dynamic_values.append(entries)
+            return []
+
+        mappings = []
+        for entry in entries:
+            if isinstance(entry, dict):
+                mappings.append(entry)
+            else:
+                self.dynamic_values.append(entry)
+        return mappings
+
+    def get_values(self, path):
+        ### Values of a matrix.* path (e.g. "matrix.config.name", with "*" for any property), plus the dynamic values.
+        properties = path.split(".")[1:]
+        if properties == [] or properties[0] == "*":
+            values = [value for key_values in self.values.values() for value in key_values]
+        else:
+            values = self.values.get(properties[0], [])
+        for name in properties[1:]:
+            values = get_property_values(values, name)
+        return values + self.dynamic_values
+
+
+def match_matrix_entry(combination, entry):
+    ### An exclude entry matches a combination when all of its values match; mappings match partially.
+    return all(key in combination and match_matrix_value(combination[key], value) for key, value in entry.items())
+
+
+def match_matrix_value(value, pattern):
+    if isinstance(value, dict) and isinstance(pattern, dict):
+        return all(key in value and match_matrix_value(value[key], pattern_value) for key, pattern_value in pattern.items())
+    return value == pattern
+
+
+def get_property_values(values, name):
+    property_values = []
+    for value in values:
+        if isinstance(value, list):
+            property_values.extend(get_property_values(value, name))
+        elif isinstance(value, dict):
+            if name == "*":
+                property_values.extend(value.values())
+            elif name in value:
+                property_values.append(value[name])
+    return property_values
+
 
 def matrix_walk(node, path="", stop_at=set()):
     if path.startswith("matrix.include."):
@@ -22,16 +189,51 @@ def matrix_walk(node, path="", stop_at=set()):
             yield from matrix_walk(v, path, stop_at)
 
 
-def analyze_matrix(matrix_text, job_data):
-    matrix_pattern = re.compile(
-        r'(?<![A-Za-z0-9_.])matrix\.[A-Za-z0-9_-]+(?:\.[A-Za-z0-9_-]+)*'
-    )
-    re_matrix = set(matrix_pattern.findall(matrix_text))
+def walk_matrix_paths(node, path=""):
+    ### matrix_walk without stop_at: every (norm, node) in the order matrix_walk visits them.
+    if path.startswith("matrix.include."):
+        norm = path.replace("matrix.include.", "matrix.", 1)
+    else:
+        norm = path
 
-    matrix_list = []
-    job_matrix_data = (job_data.get('strategy') or {})
+    yield norm, node
+
+    if isinstance(node, dict):
+        for k, v in node.items():
+            new = f"{path}.{k}" if path else k
+            yield from walk_matrix_paths(v, new)
 
-    for p, v in matrix_walk(job_matrix_data, stop_at=re_matrix):
+    elif isinstance(node, list):
+        for v in node:
+            yield from walk_matrix_paths(v, path)
+
+
+def find_matrix_references(matrix_text):
+    if not isinstance(matrix_text, str):
+        return set(MATRIX_PATTERN.findall(matrix_text))
+    return find_text_matrix_references(matrix_text)
+
+
+@lru_cache(maxsize=100000)
+def find_text_matrix_references(matrix_text):
+    return frozenset(MATRIX_PATTERN.findall(matrix_text))
+
+
+def analyze_matrix(matrix_text, job_data, index=None):
+    ### Same result as matrix_walk(job_data["strategy"], stop_at=<matrix.* references in matrix_text>).
+    if index is None:
+        index = WorkflowIndex()
+
+    re_matrix = find_matrix_references(matrix_text)
+
+    matrix_paths = index.get_matrix_paths(job_data)
+    matches = []
+    for p in re_matrix:
+        matches.extend(matrix_paths.get(p, []))
+    matches.sort(key=lambda match: match[0])
+
+    matrix_list = []
+    for position, p, v in matches:
         matrix_list.append(
             {
                 p : v 
@@ -42,11 +244,14 @@ def analyze_matrix(matrix_text, job_data):
 
 
 
-def analyze_env(env_data, job_data):
+def analyze_env(env_data, job_data, index=None):
+    if index is None:
+        index = WorkflowIndex()
+
     context_env =  {}
     if isinstance(env_data, dict):
         for env_key, env_value in env_data.items():
-            if CONTEXT_SIGNATURE in str(env_value):
+            if CONTEXT_SIGNATURE in index.get_text(env_value):
                 context_env[env_key] = env_value 
 
         return context_env
@@ -58,18 +263,21 @@ def analyze_env(env_data, job_data):
             return context_env
 
         else:
-            matrix_env_list = analyze_matrix(env_data, job_data)
+            matrix_env_list = analyze_matrix(env_data, job_data, index)
             for matrix_env in matrix_env_list:
                 for matrix_key, matrix_data in matrix_env.items():
                     if isinstance(matrix_data, dict):
                         for key, value in matrix_data.items():
-                            if CONTEXT_SIGNATURE in str(value):
+                            if CONTEXT_SIGNATURE in index.get_text(value):
                                 context_env[key] = value
 
                     elif isinstance(matrix_data, list):
                         for matrix_data_item in matrix_data:
+                            ### Lists of scalar values (`node: [18, 20]`) name no env key.
+                            if not isinstance(matrix_data_item, dict):
+                                continue
                             for matrix_data_item_key, matrix_data_item_value in matrix_data_item.items():
-                                if CONTEXT_SIGNATURE in str(matrix_data_item_value):
+                                if CONTEXT_SIGNATURE in index.get_text(matrix_data_item_value):
                                     context_env[matrix_data_item_key] = matrix_data_item_value
 
 
@@ -80,26 +288,108 @@ def analyze_env(env_data, job_data):
         return context_env
 
 
+def get_env_rules(env_data, context_env, index, env_rules=None):
+    ### {env_key: rules fired by its value}, added to env_rules (the rules of the outer levels).
+    ### Every value of env_data counts, not only those holding CONTEXT_SIGNATURE (`HEAD: ${{ github.head_ref }}`);
+    ### context_env adds the values taken from the matrix when env is an expression.
+    env_rules = dict(env_rules or {})
+    env_items = list(env_data.items()) if isinstance(env_data, dict) else []
+    for env_key, env_value in env_items + list(context_env.items()):
+        rules = match_rules(index.get_text(env_value))
+        if rules == []:
+            continue
+        env_rules[str(env_key)] = sorted(set(env_rules.get(str(env_key), [])) | set(rules))
+    return env_rules
+
+
+def add_injection_rules(step_info, text, env_rules):
+    for rule_id in match_rules(text) + match_env_rules(text, env_rules):
+        if rule_id not in step_info["injection_rules"]:
+            step_info["injection_rules"].append(rule_id)
+
+
+def get_workflow_injection_rules(workflow_content, index):
+    ### Rules fired in the steps of a workflow without CONTEXT_SIGNATURE (e.g. by github.head_ref). Only the env dicts
+    ### and the run/with blocks are read, so that its context data stays that of a workflow not using github.event.
+    step_info = {"injection_rules": []}
+    if not isinstance(workflow_content, dict) or not isinstance(workflow_content.get("jobs"), dict):
+        return []
+
+    global_env_rules = get_env_rules(workflow_content.get("env"), {}, index)
+    for job_name, job_data in workflow_content["jobs"].items():
+        if not isinstance(job_data, dict) or not isinstance(job_data.get("steps"), list):
+            continue
+        job_env_rules = get_env_rules(job_data.get("env"), {}, index, global_env_rules)
+
+        for step in job_data["steps"]:
+            if not isinstance(step, dict):
+                continue
+            step_env_rules = get_env_rules(step.get("env"), {}, index, job_env_rules)
+            if step.get("run", None) is not None:
+                add_injection_rules(step_info, index.get_text(step["run"]), step_env_rules)
+            if step.get("uses", None) is not None and step.get("with", None) is not None:
+                add_injection_rules(step_info, index.get_text(step["with"]), step_env_rules)
+
+    return step_info["injection_rules"]
+
+
+def is_event_path(path):
+    return path == CONTEXT_SIGNATURE[:-1] or path.startswith(CONTEXT_SIGNATURE)
+
+
+def get_expression_label(text, job_data, index, basic_label, matrix_label, context_env_keys=None, env_label=None):
+    ### Labels of text counting only the contexts used inside `${{ }}`: a github.event path, or a matrix path that can
+    ### take a value holding CONTEXT_SIGNATURE (looked up in the MatrixModel of the job). Unlike the substring check, `toJSON(github.event)` counts, comments and plain
+    ### strings do not.
+    ### With env_label, `${{ env.KEY }}` of a context env is labeled too: it is expanded into the text like the context itself.
+    expression_label = []
+    paths = get_context_paths(text)
+    if any(is_event_path(path) for path in paths):
+        expression_label.append(basic_label)
+
+    matrix_references = [path for path in paths if path.startswith("matrix.")]
+    if matrix_references != []:
+        matrix_model = index.get_matrix_model(job_data)
+        for path in matrix_references:
+            if any(CONTEXT_SIGNATURE in index.get_text(value) for value in matrix_model.get_values(path)):
+                expression_label.append(matrix_label)
+                break
+
+    if env_label is not None:
+        env_references = {path.split(".")[1] for path in paths if path.startswith("env.")}
+        if any(str(env_key) in env_references for env_key in context_env_keys):
+            expression_label.append(env_label)
+
+    return expression_label
+
+
 def get_context_data(workflow_content):
     result = {
         "use_github_context": False,
         "job_result": {}
     }
 
-    if CONTEXT_SIGNATURE in str(workflow_content):
+    index = WorkflowIndex()
+    workflow_text = index.get_text(workflow_content)
+    if CONTEXT_SIGNATURE in workflow_text:
         result["use_github_context"] = True
     else:
         result["use_github_context"] = False
+        ### Rules without CONTEXT_SIGNATURE (github.head_ref) are recorded for the whole workflow.
+        if RULE_PATTERN.search(workflow_text) is not None:
+            result["injection_rules"] = get_workflow_injection_rules(workflow_content, index)
         return result
 
   
     global_env = workflow_content.get("env", {}) or {}
-    context_global_env = analyze_env(global_env, workflow_content) 
+    context_global_env = analyze_env(global_env, workflow_content, index) 
     result["context_global_env"] = context_global_env
+    global_env_rules = get_env_rules(global_env, context_global_env, index)
     
     for job_name, job_data in (workflow_content.get("jobs") or {}).items():
         job_env = job_data.get("env", {}) or {}    
-        context_job_env = analyze_env(job_env, job_data)    
+        context_job_env = analyze_env(job_env, job_data, index)    
+        job_env_rules = get_env_rules(job_env, context_job_env, index, global_env_rules)
 
         result["job_result"][job_name] = {
             "context_job_env": context_job_env,
@@ -112,31 +402,41 @@ def get_context_data(workflow_content):
             step_id += 1
 
             step_env = step.get("env", {}) or {}
-            context_step_env = analyze_env(step_env, job_data)
+            context_step_env = analyze_env(step_env, job_data, index)
+            step_env_rules = get_env_rules(step_env, context_step_env, index, job_env_rules)
                 
             step_info = {
                 "type": "None",
                 "label": [],
                 "context_step_env": context_step_env,
-                "used_env_key": []
+                "used_env_key": [],
+                "injection_rules": [],
+                "expression_label": []
             }
 
             run = step.get("run", None)
             if run != None:
                 step_info["type"] = "run"
 
-                if CONTEXT_SIGNATURE in str(run):
+                run_text = index.get_text(run)
+                if CONTEXT_SIGNATURE in run_text:
                     step_info["label"].append("injection_risk_basic")
 
-                if "matrix." in str(run):
-                    matrix_list = analyze_matrix(run, job_data)
-                    if CONTEXT_SIGNATURE in str(matrix_list):
+                if "matrix." in run_text:
+                    matrix_list = analyze_matrix(run, job_data, index)
+                    if index.has_signature(matrix_list):
                         step_info["label"].append("injection_risk_matrix")
 
+                context_env_keys = context_global_env.keys() | context_job_env.keys() | context_step_env.keys()
+                step_info["expression_label"].extend(get_expression_label(run_text, job_data, index, "injection_risk_basic", "injection_risk_matrix", context_env_keys, "injection_risk_env"))
+
                 for env_key, env_value in context_global_env.items() | context_job_env.items() | context_step_env.items():
-                    if env_key in str(run):
+                    if env_key in run_text:
                         step_info["label"].append("practice2")
+                        step_info["expression_label"].append("practice2")
                         step_info["used_env_key"].append(env_key)
+
+                add_injection_rules(step_info, run_text, step_env_rules)
                          
             uses = step.get("uses", None)
             if uses != None:
@@ -147,19 +447,25 @@ def get_context_data(workflow_content):
                 if uses_with != None:
                     step_info["with"] = True
 
-                    if CONTEXT_SIGNATURE in str(uses_with):
+                    with_text = index.get_text(uses_with)
+                    if CONTEXT_SIGNATURE in with_text:
                         step_info["label"].append("practice1_basic")
 
-                    if "matrix." in str(uses_with):
-                        matrix_list = analyze_matrix(str(uses_with), job_data)
-                        if CONTEXT_SIGNATURE in str(matrix_list):
+                    if "matrix." in with_text:
+                        matrix_list = analyze_matrix(with_text, job_data, index)
+                        if index.has_signature(matrix_list):
                             step_info["label"].append("practice1_matrix")
 
+                    step_info["expression_label"].extend(get_expression_label(with_text, job_data, index, "practice1_basic", "practice1_matrix"))
+
                     for env_key, env_value in context_global_env.items() | context_job_env.items() | context_step_env.items():
-                        if env_key in str(uses_with):
+                        if env_key in with_text:
                             step_info["label"].append("practice1_env")
+                            step_info["expression_label"].append("practice1_env")
                             step_info["used_env_key"].append(env_key)
 
+                    add_injection_rules(step_info, with_text, step_env_rules)
+
                 else:
                     step_info["with"] = False
 
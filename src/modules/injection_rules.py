@@ -0,0 +1,93 @@
+import re
+from functools import lru_cache
+
+from modules.expression_parser import get_expression_sources
+
+
+### Finer-grained labels for Practice 2: which attacker-controlled contexts a `run` script or a `with` block refers to.
+### Each rule is a list of context paths. "*" stands for one property (`.name`, `.*` or `[...]`), "**" for one or more.
+### Literal properties also match the index syntax (`github.event['issue']['title']`).
+### Only the contexts inside `${{ }}` count, so shell comments and plain strings fire no rule. Environment variables
+### are matched by name in the whole text (match_env_rules), so a comment naming one still fires its "env:" rules.
+### All rules are compiled into one regular expression, so a step is scanned once whatever the number of rules.
+### At one position the first rule in INJECTION_RULES wins, so specific rules come before the catch-all "github_event".
+INJECTION_RULES = [
+    ("issue_title", ["github.event.issue.title"]),
+    ("issue_body", ["github.event.issue.body"]),
+    ("pull_request_title", ["github.event.pull_request.title"]),
+    ("pull_request_body", ["github.event.pull_request.body"]),
+    ("pull_request_head_ref", ["github.head_ref", "github.event.pull_request.head.ref", "github.event.pull_request.head.label"]),
+    ("pull_request_default_branch", ["github.event.pull_request.head.repo.default_branch"]),
+    ("comment_body", ["github.event.comment.body", "github.event.review.body", "github.event.review_comment.body"]),
+    ("discussion", ["github.event.discussion.title", "github.event.discussion.body"]),
+    ("pages_page_name", ["github.event.pages.*.page_name"]),
+    ("commit_message", ["github.event.commits.*.message", "github.event.head_commit.message", "github.event.workflow_run.head_commit.message"]),
+    ("commit_author", [
+        "github.event.commits.*.author.email",
+        "github.event.commits.*.author.name",
+        "github.event.head_commit.author.email",
+        "github.event.head_commit.author.name",
+        "github.event.workflow_run.head_commit.author.email",
+        "github.event.workflow_run.head_commit.author.name",
+    ]),
+    ("workflow_run_head_branch", ["github.event.workflow_run.head_branch", "github.event.workflow_run.pull_requests.*.head.ref"]),
+    ("nested_body", ["github.event.*.*.body"]),
+    ("github_event", ["github.event.**"]),
+]
+### Prefix of the rules fired by an environment variable whose value refers to a context (e.g. "env:issue_title").
+ENV_RULE_PREFIX = "env:"
+CONTEXT_ROOT = "github"
+
+PROPERTY = r"(?:\.[A-Za-z0-9_-]+|\.\*|\[[^\]\n]*\])"
+
+
+def compile_context(context):
+    ### Every context starts with CONTEXT_ROOT, which compile_rules puts in front of all of them.
+    properties = context.split(".")[1:]
+    pattern = ""
+    for name in properties:
+        if name == "*":
+            pattern += PROPERTY
+        elif name == "**":
+            pattern += PROPERTY + "+"
+        else:
+            pattern += rf"(?:\.{re.escape(name)}|\[\s*['\"]{re.escape(name)}['\"]\s*\])"
+    return pattern
+
+
+def compile_rules(rules):
+    ### One named group per rule, in the order of the rules: m.lastgroup is the rule that fired.
+    groups = []
+    for rule_index, (rule_id, contexts) in enumerate(rules):
+        groups.append(f"(?P<r{rule_index}>{'|'.join(compile_context(context) for context in contexts)})")
+    ### With the literal CONTEXT_ROOT first, the regex engine skips to its occurrences instead of trying every rule at every
+    ### position; the boundary before it is checked right after.
+    return re.compile(rf"{re.escape(CONTEXT_ROOT)}(?<![A-Za-z0-9_.-]{re.escape(CONTEXT_ROOT)})(?:{'|'.join(groups)})(?![A-Za-z0-9_-])")
+
+
+RULE_IDS = {f"r{rule_index}": rule_id for rule_index, (rule_id, contexts) in enumerate(INJECTION_RULES)}
+RULE_PATTERN = compile_rules(INJECTION_RULES)
+
+
+def match_rules(text):
+    ### Rule ids fired by the expressions in text, in the order of INJECTION_RULES.
+    fired = {RULE_IDS[m.lastgroup] for source in get_expression_sources(text) for m in RULE_PATTERN.finditer(source)}
+    return [rule_id for rule_id, contexts in INJECTION_RULES if rule_id in fired]
+
+
+@lru_cache(maxsize=1024)
+def compile_env_keys(env_keys):
+    return re.compile(rf"(?<![A-Za-z0-9_])(?:{'|'.join(re.escape(env_key) for env_key in env_keys)})(?![A-Za-z0-9_])")
+
+
+def match_env_rules(text, env_rules):
+    ### env_rules: {env_key: rules fired by its value}. An environment variable is used when its name appears in text as
+    ### a whole word ($TITLE, ${TITLE}, env.TITLE, process.env.TITLE, ...); all used names are found in one pass.
+    if env_rules == {}:
+        return []
+
+    env_keys = tuple(sorted(env_rules))
+    fired = set()
+    for m in compile_env_keys(env_keys).finditer(text):
+        fired.update(env_rules[m.group(0)])
+    return [f"{ENV_RULE_PREFIX}{rule_id}" for rule_id, contexts in INJECTION_RULES if rule_id in fired]
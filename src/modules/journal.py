@@ -0,0 +1,81 @@
+import os
+import json
+
+
+class Journal:
+    ### Append-only JSONL log of finished repositories for one month of one stage.
+    ### Every entry is flushed as soon as it is written, so a crash or kill only loses the repository in progress.
+    def __init__(self, journal_path, resume=False):
+        self.journal_path = journal_path
+        self.entries = {}
+        self.file = None
+
+        if resume == True:
+            self.load()
+        elif os.path.exists(journal_path):
+            os.remove(journal_path)
+
+    def load(self):
+        if os.path.exists(self.journal_path) == False:
+            return
+
+        valid_size = 0
+        with open(self.journal_path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if line.endswith(b"\n") == False:
+                    break
+                self.entries[entry["name"]] = entry
+                valid_size += len(line)
+
+        ### The last line may be cut off when the process was killed while writing it.
+        ### Drop it so that new entries are appended after the last complete line.
+        with open(self.journal_path, "r+b") as f:
+            f.truncate(valid_size)
+
+    def is_done(self, name):
+        return name in self.entries
+
+    def get_data(self, name):
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        return entry["data"]
+
+    def append(self, name, status, data=None):
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            self.file = open(self.journal_path, "a")
+
+        entry = {"name": name, "status": status, "data": data}
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+        self.entries[name] = entry
+
+    def compact(self, results, names):
+        ### Rebuild the month output from the journal, in the order of the input names.
+        for name in names:
+            entry = self.entries.get(name)
+            if entry is None:
+                continue
+
+            if isinstance(results[entry["status"]], list):
+                results[entry["status"]].append(name)
+            else:
+                results[entry["status"]][name] = entry["data"]
+
+        return results
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        ### Called after compaction, once the month output file has been written.
+        self.close()
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
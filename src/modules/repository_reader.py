@@ -0,0 +1,285 @@
+import os
+import io
+import errno
+import fnmatch
+import hashlib
+import posixpath
+import subprocess
+
+from modules.analyzed_paths import WORKFLOWS_DIR, WORKFLOW_FILE_PATTERN, CODEOWNERS_PATHS, DEPENDABOT_PATHS
+
+
+SYMLINK_MODE = "120000"
+MAX_SYMLINK_DEPTH = 40
+
+
+def scan_directory(directory):
+    try:
+        with os.scandir(directory) as scandir_it:
+            return list(scandir_it)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        return []
+
+
+def is_real_directory(entry):
+    try:
+        return entry.is_dir(follow_symlinks=False)
+    except OSError:
+        return False
+
+
+def get_manifest_directories():
+    ### Directories holding the CODEOWNERS and dependabot candidates, parents first.
+    directories = set()
+    for path in CODEOWNERS_PATHS + DEPENDABOT_PATHS:
+        directory = posixpath.dirname(path)
+        while directory != "":
+            directories.add(directory)
+            directory = posixpath.dirname(directory)
+    return sorted(directories, key=lambda directory: (directory.count("/"), directory))
+
+
+class WorkTreeReader:
+    ### Reads files from a checked-out repository (CLONE_MODE "FULL" or "SPARSE").
+    def __init__(self, repo_dir):
+        self.repo_dir = repo_dir
+
+    def list_files(self, directory, pattern):
+        ### Same paths in the same order as Path(repo_dir, directory).rglob(pattern), with one scandir per directory.
+        start_dir = os.path.join(self.repo_dir, directory)
+        if os.path.isdir(start_dir) == False:
+            return []
+
+        files = []
+        pending = [(start_dir, directory.strip("/"))]
+        while pending:
+            current_dir, relative_dir = pending.pop()
+            entries = scan_directory(current_dir)
+            subdirectories = []
+            for entry in entries:
+                relative_path = posixpath.join(relative_dir, entry.name)
+                if fnmatch.fnmatchcase(entry.name, pattern):
+                    files.append(relative_path)
+                if is_real_directory(entry):
+                    subdirectories.append((entry.path, relative_path))
+            pending.extend(reversed(subdirectories))
+        return files
+
+    def get_manifest(self):
+        ### One pass over the few directories the analyzers care about instead of an rglob over the whole tree.
+        ### Like rglob, symbolic links to directories are not followed below the repository root.
+        manifest = {
+            "workflow_files": self.list_files(WORKFLOWS_DIR, WORKFLOW_FILE_PATTERN),
+            "codeowners_files": [],
+            "dependabot_files": [],
+        }
+
+        scanned_entries = {"": scan_directory(self.repo_dir)}
+        for directory in get_manifest_directories():
+            parent, name = posixpath.split(directory)
+            parent_entries = scanned_entries.get(parent, [])
+            if any(entry.name == name and is_real_directory(entry) for entry in parent_entries):
+                scanned_entries[directory] = scan_directory(os.path.join(self.repo_dir, directory))
+
+        for directory, entries in scanned_entries.items():
+            for entry in entries:
+                path = posixpath.join(directory, entry.name)
+                if path in CODEOWNERS_PATHS:
+                    manifest["codeowners_files"].append(path)
+                if path in DEPENDABOT_PATHS:
+                    manifest["dependabot_files"].append({"path": path, "is_symlink": entry.is_symlink()})
+
+        return manifest
+
+    def exists(self, path):
+        return os.path.lexists(os.path.join(self.repo_dir, path))
+
+    def is_symlink(self, path):
+        return os.path.islink(os.path.join(self.repo_dir, path))
+
+    def open(self, path, errors=None):
+        return open(os.path.join(self.repo_dir, path), "r", errors=errors)
+
+    def read_bytes(self, path):
+        with open(os.path.join(self.repo_dir, path), "rb") as f:
+            return f.read()
+
+    def read_link(self, path):
+        return os.readlink(os.path.join(self.repo_dir, path))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BareRepositoryReader:
+    ### Reads files of HEAD from a bare repository (CLONE_MODE "BARE") without a working tree.
+    ### The tree is listed once with `git ls-tree`, and blobs are read through one long-lived `git cat-file --batch` process.
+    def __init__(self, repo_dir):
+        self.repo_dir = repo_dir
+        self.process = None
+        self.tree_entries = None
+
+    @property
+    def entries(self):
+        ### Listed on first use, so opening a reader only to look at a stored manifest costs nothing.
+        if self.tree_entries is None:
+            self.tree_entries = self.load_tree()
+        return self.tree_entries
+
+    def load_tree(self):
+        entries = {}
+        result = subprocess.run(
+            ["git", "-C", self.repo_dir, "ls-tree", "-r", "-z", "--full-tree", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+            )
+        ### An empty repository has no HEAD commit, so it has no files.
+        if result.returncode != 0:
+            return entries
+
+        for record in result.stdout.split(b"\0"):
+            if not record:
+                continue
+
+            meta, path = record.split(b"\t", 1)
+            mode, object_type, object_id = meta.decode().split(" ")
+            if object_type != "blob":
+                continue
+
+            entries[os.fsdecode(path)] = (mode, object_id)
+
+        return entries
+
+    def list_files(self, directory, pattern):
+        prefix = directory.strip("/") + "/" if directory.strip("/") else ""
+        files = []
+        for path in self.entries:
+            if path.startswith(prefix) and fnmatch.fnmatchcase(posixpath.basename(path), pattern):
+                files.append(path)
+        return files
+
+    def get_manifest(self):
+        return {
+            "workflow_files": self.list_files(WORKFLOWS_DIR, WORKFLOW_FILE_PATTERN),
+            "codeowners_files": [path for path in CODEOWNERS_PATHS if path in self.entries],
+            "dependabot_files": [{"path": path, "is_symlink": self.is_symlink(path)} for path in sorted(DEPENDABOT_PATHS) if path in self.entries],
+        }
+
+    def exists(self, path):
+        return path in self.entries
+
+    def is_symlink(self, path):
+        entry = self.entries.get(path)
+        return entry is not None and entry[0] == SYMLINK_MODE
+
+    def resolve(self, path):
+        ### Follow symbolic links inside the repository, as open() does on a working tree.
+        for _ in range(MAX_SYMLINK_DEPTH):
+            entry = self.entries.get(path)
+            if entry is None:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), os.path.join(self.repo_dir, path))
+
+            mode, object_id = entry
+            if mode != SYMLINK_MODE:
+                return object_id
+
+            target = os.fsdecode(self.read_object(object_id))
+            path = posixpath.normpath(posixpath.join(posixpath.dirname(path), target))
+
+        raise OSError(errno.ELOOP, os.strerror(errno.ELOOP), os.path.join(self.repo_dir, path))
+
+    def read_object(self, object_id):
+        if self.process is None:
+            self.process = subprocess.Popen(
+                ["git", "-C", self.repo_dir, "cat-file", "--batch"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL
+                )
+
+        self.process.stdin.write(object_id.encode() + b"\n")
+        self.process.stdin.flush()
+
+        header = self.process.stdout.readline().split()
+        if len(header) != 3:
+            raise FileNotFoundError(errno.ENOENT, f"Object not found: {object_id}", self.repo_dir)
+
+        data = self.process.stdout.read(int(header[2]))
+        self.process.stdout.read(1)
+        return data
+
+    def read_bytes(self, path):
+        return self.read_object(self.resolve(path))
+
+    def read_link(self, path):
+        return os.fsdecode(self.read_object(self.entries[path][1]))
+
+    def open(self, path, errors=None):
+        return open_text(self.repo_dir, path, self.read_object(self.resolve(path)), errors)
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def is_bare_repository(repo_dir):
+    return os.path.exists(os.path.join(repo_dir, ".git")) == False and os.path.isfile(os.path.join(repo_dir, "HEAD")) and os.path.isdir(os.path.join(repo_dir, "objects"))
+
+
+def open_text(repo_dir, path, content, errors=None):
+    ### A text file over content already read with read_bytes.
+    ### Decoding and newline handling are left to TextIOWrapper so the result matches open() on a working tree.
+    ### The name is kept so that YAML error messages point to the same path.
+    buffer = io.BytesIO(content)
+    buffer.name = os.path.join(repo_dir, path)
+    return io.TextIOWrapper(buffer, errors=errors)
+
+
+def open_repository(repo_dir):
+    if is_bare_repository(repo_dir):
+        return BareRepositoryReader(repo_dir)
+    else:
+        return WorkTreeReader(repo_dir)
+
+
+def get_repository_manifest(repository, repository_data=None):
+    ### 1_analyze_repository_data.py stores the manifest in repository_data; older files fall back to a scan.
+    if repository_data is not None and "MANIFEST" in repository_data:
+        return repository_data["MANIFEST"]
+    return repository.get_manifest()
+
+
+def get_analyzed_files(repository):
+    paths = repository.list_files(WORKFLOWS_DIR, WORKFLOW_FILE_PATTERN)
+    paths += [path for path in CODEOWNERS_PATHS + DEPENDABOT_PATHS if repository.exists(path)]
+    return sorted(set(paths))
+
+
+def get_analyzed_fingerprint(repo_dir):
+    ### Hash of the files read by the analyzers, so that it changes only when a change can affect the analysis results.
+    digest = hashlib.sha256()
+    with open_repository(repo_dir) as repository:
+        for path in get_analyzed_files(repository):
+            try:
+                content = repository.read_bytes(path)
+            except OSError:
+                content = b""
+            digest.update(f"{path}\0{repository.is_symlink(path)}\0{len(content)}\0".encode())
+            digest.update(content)
+
+    return digest.hexdigest()
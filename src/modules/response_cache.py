@@ -0,0 +1,85 @@
+import os
+import json
+import hashlib
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+CACHED_HEADERS = ["Content-Type", "Link", "ETag", "Last-Modified"]
+RATE_LIMIT_HEADERS = ["X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset", "X-RateLimit-Used", "X-RateLimit-Resource"]
+
+
+class ResponseCache:
+    ### Stores response bodies on disk together with their ETag / Last-Modified, keyed by URL.
+    ### GitHub does not count "304 Not Modified" responses against the rate limit.
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def get_cache_path(self, api_url):
+        cache_key = hashlib.sha256(api_url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, cache_key[:2], f"{cache_key}.json")
+
+    def load(self, api_url):
+        cache_path = self.get_cache_path(api_url)
+        if os.path.exists(cache_path) == False:
+            return None
+
+        try:
+            with open(cache_path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if entry.get("url") != api_url:
+            return None
+
+        return entry
+
+    def get_conditional_headers(self, entry):
+        headers = {}
+        if entry is None:
+            return headers
+
+        if entry.get("etag") is not None:
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified") is not None:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        return headers
+
+    def store(self, api_url, response):
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag is None and last_modified is None:
+            return
+
+        entry = {
+            "url": api_url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "headers": {key: response.headers[key] for key in CACHED_HEADERS if key in response.headers},
+            "body": response.text
+        }
+
+        cache_path = self.get_cache_path(api_url)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+
+        ### Write to a temporary file first so that concurrent readers never see a partial entry.
+        temp_path = f"{cache_path}.{os.getpid()}.{id(entry)}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(entry, f)
+        os.replace(temp_path, cache_path)
+
+    def build_response(self, entry, not_modified_response):
+        ### Rebuild a "200 OK" response from the cached body, with the current rate limit headers.
+        response = requests.Response()
+        response.status_code = 200
+        response.url = entry["url"]
+        response.encoding = "utf-8"
+        response._content = entry["body"].encode("utf-8")
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        for key in RATE_LIMIT_HEADERS:
+            if key in not_modified_response.headers:
+                response.headers[key] = not_modified_response.headers[key]
+
+        return response
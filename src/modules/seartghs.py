@@ -0,0 +1,45 @@
+import os
+import pandas as pd
+
+import settings as st
+
+
+def get_seartghs_month_path(year, month):
+    return os.path.join(st.SEARTGHS_BY_MONTH_DIR, f"results_{year}_{month}.csv")
+
+
+def get_seartghs_parquet_path(year, month):
+    return os.path.join(st.SEARTGHS_BY_MONTH_DIR, f"results_{year}_{month}.parquet")
+
+
+def load_seartghs_month(year, month, columns=None):
+    ### With columns, only those columns are read, from the Parquet partition when 1_split_seartghs_by_month.py wrote one.
+    ### Full records are always read from the CSV, so the values stored in repository_data do not depend on the format.
+    source_file = get_seartghs_month_path(year, month)
+    if os.path.exists(source_file) == False:
+        print(f"[Error] File not found: {source_file}")
+        return None
+
+    parquet_file = get_seartghs_parquet_path(year, month)
+    if columns is not None and os.path.exists(parquet_file) == True:
+        return pd.read_parquet(parquet_file, columns=columns)
+
+    return pd.read_csv(source_file, usecols=columns)
+
+
+def build_seartghs_index(df_seartghs):
+    ### Repository name -> SEART-GHS record, built in one pass instead of one DataFrame scan per repository.
+    ### If a name appears more than once, the first row wins, as with df[df["name"] == name].to_dict(orient="records")[0].
+    seartghs_index = {}
+    for record in df_seartghs.to_dict(orient="records"):
+        if record["name"] not in seartghs_index:
+            seartghs_index[record["name"]] = record
+    return seartghs_index
+
+
+def load_seartghs_index(year, month):
+    df_seartghs = load_seartghs_month(year, month)
+    if df_seartghs is None:
+        return None
+
+    return build_seartghs_index(df_seartghs)
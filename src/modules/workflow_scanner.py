@@ -0,0 +1,350 @@
+import re
+import yaml
+
+import settings as st
+from modules.github_context_parser import CONTEXT_SIGNATURE
+from modules.injection_rules import RULE_PATTERN
+
+
+### Lexical fast path for workflow files that do not use CONTEXT_SIGNATURE.
+### For those files get_context_data returns without looking at the content, so only get_actions_list needs the
+### structure: jobs -> steps -> uses. scan_workflow reads that directly from the file bytes without building the YAML
+### document.
+### The scanner accepts only a plain subset of block YAML (block mappings and sequences, single-line plain or quoted
+### scalars, "|"/">" block scalars, one-line flow sequences of simple scalars such as `branches: [main]`). Anything else
+### (anchors, aliases, tags, flow mappings, nested flow collections, multi-line or escaped scalars, several documents,
+### tabs, ...) returns None, and the file goes through the full YAML parse.
+### `1_analyze_repository_data.py --verify-fast-path` compares the two paths file by file.
+
+UNSUPPORTED_BYTES = re.compile(rb"[\t\x00-\x08\x0b\x0c\x0e-\x1f\x7f]|\r(?!\n)|\xc2\x85|\xe2\x80[\xa8\xa9]|\xef\xbb\xbf")
+NON_PRINTABLE = re.compile("[^\x09\x0A\x0D\x20-\x7E\x85\xA0-\uD7FF\uE000-\uFFFD\U00010000-\U0010ffff]")
+BLOCK_SCALAR_HEADER = re.compile(r"[|>][-+]?(?:\s+#.*)?$")
+FLOW_SEQUENCE_ITEM = r"(?:[A-Za-z0-9_./][A-Za-z0-9_./ -]*?|'[^']*'|\"[^\"\\\\]*\")"
+FLOW_SEQUENCE = re.compile(rf"\[\s*(?:{FLOW_SEQUENCE_ITEM}(?:\s*,\s*{FLOW_SEQUENCE_ITEM})*)?\s*\](?:\s+#.*)?$")
+PLAIN_SCALAR_INDICATORS = "-?:,[]{}#&*!|>'\"%@`"
+MAX_SIMPLE_KEY_LENGTH = 1000
+
+STR_TAG = "tag:yaml.org,2002:str"
+resolver = yaml.resolver.Resolver()
+
+
+class UnsupportedSyntax(Exception):
+    pass
+
+
+class Line:
+    def __init__(self, indent, text):
+        self.indent = indent
+        self.text = text
+
+
+def strip_comment(text):
+    ### A comment starts at a "#" preceded by a space (the text here never starts with "#").
+    position = text.find(" #")
+    if position != -1:
+        text = text[:position]
+    return text.rstrip(" ")
+
+
+def parse_scalar(text):
+    ### Returns (value, is_plain) for a single-line scalar.
+    if text.startswith("'"):
+        end = text.find("'", 1)
+        while end != -1 and text[end + 1:end + 2] == "'":
+            end = text.find("'", end + 2)
+        if end == -1 or strip_comment(text[end + 1:]) != "":
+            raise UnsupportedSyntax()
+        return text[1:end].replace("''", "'"), False
+
+    if text.startswith('"'):
+        end = text.find('"', 1)
+        if end == -1 or "\\" in text[1:end] or strip_comment(text[end + 1:]) != "":
+            raise UnsupportedSyntax()
+        return text[1:end], False
+
+    value = strip_comment(text)
+    if value == "" or value[0] in PLAIN_SCALAR_INDICATORS or ": " in value or value.endswith(":"):
+        raise UnsupportedSyntax()
+    return value, True
+
+
+def split_key(text):
+    ### Returns (key, rest) for "key: rest" / "key:", or None when the text is not a mapping entry.
+    if text[0] in "'\"":
+        quote = text[0]
+        end = text.find(quote, 1)
+        if end == -1 or text[end + 1:end + 2] != ":" or text[end + 2:end + 3] not in ("", " "):
+            if ": " in text or text.endswith(":"):
+                raise UnsupportedSyntax()
+            return None
+        key, is_plain = parse_scalar(text[:end + 1])
+        return key, text[end + 2:].strip(" ")
+
+    position = text.find(": ")
+    if position == -1:
+        if text.endswith(":") == False:
+            return None
+        position = len(text) - 1
+
+    key = text[:position].rstrip(" ")
+    if key == "" or key[0] in PLAIN_SCALAR_INDICATORS or " #" in key or len(key) > MAX_SIMPLE_KEY_LENGTH:
+        raise UnsupportedSyntax()
+    return key, text[position + 1:].strip(" ")
+
+
+class Scanner:
+    def __init__(self, text):
+        self.lines = self.split_lines(text)
+        self.position = 0
+
+    def split_lines(self, text):
+        lines = []
+        raw_lines = text.split("\n")
+        index = 0
+        while index < len(raw_lines):
+            raw_line = raw_lines[index]
+            index += 1
+            text = raw_line.lstrip(" ")
+            if text == "" or text.startswith("#"):
+                continue
+
+            indent = len(raw_line) - len(text)
+            if indent == 0 and (text.startswith("---") or text.startswith("...") or text.startswith("%")):
+                raise UnsupportedSyntax()
+
+            ### "- key: value" is a sequence entry holding a mapping that starts at the column of "key".
+            entry_indent = None
+            while text.startswith("- ") or text == "-":
+                lines.append(Line(indent, "-"))
+                entry_indent = indent
+                rest = text[1:].lstrip(" ")
+                if rest == "" or rest.startswith("#"):
+                    text = ""
+                    break
+                indent += len(text) - len(rest)
+                text = rest
+
+            if text == "":
+                continue
+
+            lines.append(Line(indent, text))
+            if text[0] in "|>":
+                if entry_indent is None or BLOCK_SCALAR_HEADER.match(text) is None:
+                    raise UnsupportedSyntax()
+                index = self.skip_block_scalar(raw_lines, index, entry_indent + 1)
+            else:
+                entry = split_key(text)
+                if entry is not None and BLOCK_SCALAR_HEADER.match(entry[1]) is not None:
+                    index = self.skip_block_scalar(raw_lines, index, indent + 1)
+
+        return lines
+
+    def skip_block_scalar(self, raw_lines, index, min_indent):
+        ### The content of a block scalar is every following line indented more than the mapping (or sequence) that
+        ### holds it, and it is never looked at.
+        content_indent = None
+        leading_blank_spaces = 0
+        while index < len(raw_lines):
+            raw_line = raw_lines[index]
+            text = raw_line.lstrip(" ")
+            indent = len(raw_line) - len(text)
+            if text == "":
+                if content_indent is None:
+                    leading_blank_spaces = max(leading_blank_spaces, indent)
+                index += 1
+                continue
+
+            if content_indent is None:
+                if indent < min_indent:
+                    break
+                if leading_blank_spaces > indent:
+                    raise UnsupportedSyntax()
+                content_indent = indent
+
+            if indent < content_indent:
+                if indent >= min_indent:
+                    raise UnsupportedSyntax()
+                break
+
+            index += 1
+
+        return index
+
+    def peek(self):
+        if self.position < len(self.lines):
+            return self.lines[self.position]
+        return None
+
+    def parse_document(self):
+        line = self.peek()
+        if line is None:
+            raise UnsupportedSyntax()
+
+        node = self.parse_node(line.indent)
+        if not isinstance(node, dict) or self.peek() is not None:
+            raise UnsupportedSyntax()
+        return node
+
+    def parse_node(self, min_indent):
+        ### Mappings are returned as dicts of {key: node} and sequences as lists.
+        ### Scalars are returned as ("plain", value) or ("quoted", value), and values that are never looked at as ("block", None)
+        ### or ("flow", None). A missing value is None.
+        line = self.peek()
+        if line is None or line.indent < min_indent:
+            return None
+
+        if line.text == "-":
+            return self.parse_sequence(line.indent)
+        if split_key(line.text) is not None:
+            return self.parse_mapping(line.indent)
+        raise UnsupportedSyntax()
+
+    def parse_sequence(self, indent):
+        items = []
+        while True:
+            line = self.peek()
+            ### A line at the same indentation that is not an entry ends a sequence written at the indentation of its key.
+            if line is None or line.indent < indent or (line.indent == indent and line.text != "-"):
+                return items
+            if line.indent > indent:
+                raise UnsupportedSyntax()
+
+            self.position += 1
+            items.append(self.parse_entry_value(indent))
+
+    def parse_mapping(self, indent):
+        mapping = {}
+        while True:
+            line = self.peek()
+            if line is None or line.indent < indent:
+                return mapping
+            if line.indent > indent or line.text == "-":
+                raise UnsupportedSyntax()
+
+            entry = split_key(line.text)
+            if entry is None:
+                raise UnsupportedSyntax()
+
+            key, rest = entry
+            if key in mapping or key == "<<":
+                raise UnsupportedSyntax()
+
+            self.position += 1
+            if rest == "" or rest.startswith("#"):
+                next_line = self.peek()
+                ### A sequence may be written at the same indentation as its key.
+                if next_line is not None and next_line.indent == indent and next_line.text == "-":
+                    mapping[key] = self.parse_sequence(indent)
+                else:
+                    mapping[key] = self.parse_node(indent + 1)
+            else:
+                mapping[key] = self.parse_inline_value(rest)
+
+            next_line = self.peek()
+            if next_line is not None and next_line.indent > indent:
+                raise UnsupportedSyntax()
+
+    def parse_entry_value(self, indent):
+        line = self.peek()
+        if line is None or line.indent <= indent:
+            return None
+
+        if line.text != "-" and split_key(line.text) is None:
+            self.position += 1
+            value = self.parse_inline_value(line.text)
+            next_line = self.peek()
+            if next_line is not None and next_line.indent > indent:
+                raise UnsupportedSyntax()
+            return value
+
+        return self.parse_node(indent + 1)
+
+    def parse_inline_value(self, text):
+        if BLOCK_SCALAR_HEADER.match(text) is not None:
+            return ("block", None)
+        if FLOW_SEQUENCE.match(text) is not None:
+            return ("flow", None)
+        value, is_plain = parse_scalar(text)
+        return ("plain" if is_plain == True else "quoted", value)
+
+
+def get_scalar_string(node):
+    ### The value of a scalar node if it is loaded as a str, otherwise None.
+    if not isinstance(node, tuple) or node[0] not in ("plain", "quoted"):
+        return None
+    kind, value = node
+    if kind == "plain" and resolver.resolve(yaml.ScalarNode, value, (True, False)) != STR_TAG:
+        return None
+    return value
+
+
+def get_job_actions(job):
+    if not isinstance(job, dict):
+        raise UnsupportedSyntax()
+    if "steps" not in job:
+        return []
+    if not isinstance(job["steps"], list):
+        raise UnsupportedSyntax()
+
+    actions_list = []
+    for step in job["steps"]:
+        if not isinstance(step, dict):
+            raise UnsupportedSyntax()
+        if "uses" in step:
+            action = get_scalar_string(step["uses"])
+            if action is None:
+                raise UnsupportedSyntax()
+            actions_list.append(action)
+    return actions_list
+
+
+def scan_workflow(content):
+    ### content: bytes of the workflow file.
+    ### Returns the actions_list of get_actions_list, or None if the file has to be parsed as YAML.
+    if CONTEXT_SIGNATURE.encode() in content or UNSUPPORTED_BYTES.search(content) is not None:
+        return None
+    ### Files over the limits of yaml_loader are left to it, so that they are skipped in the same way.
+    if st.YAML_MAX_FILE_SIZE is not None and len(content) > st.YAML_MAX_FILE_SIZE:
+        return None
+
+    try:
+        text = content.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+    if NON_PRINTABLE.search(text) is not None:
+        return None
+    ### Steps matching an injection rule get context data of their own, which only the full parse gives.
+    if RULE_PATTERN.search(text) is not None:
+        return None
+
+    try:
+        scanner = Scanner(text.replace("\r\n", "\n"))
+        ### Every line holds at most two nodes (a key and its value).
+        if st.YAML_MAX_EXPANDED_NODES is not None and 2 * len(scanner.lines) + 1 > st.YAML_MAX_EXPANDED_NODES:
+            return None
+
+        document = scanner.parse_document()
+        if "jobs" not in document:
+            return []
+
+        jobs = document["jobs"]
+        if not isinstance(jobs, dict):
+            raise UnsupportedSyntax()
+
+        actions_list = []
+        for job_id, job in jobs.items():
+            if job_id != get_scalar_string(("plain", job_id)):
+                raise UnsupportedSyntax()
+            actions_list.extend(get_job_actions(job))
+        return actions_list
+
+    except UnsupportedSyntax:
+        return None
+
+
+def get_scanned_context_data():
+    ### What get_context_data returns for a workflow without CONTEXT_SIGNATURE or an injection rule.
+    return {
+        "use_github_context": False,
+        "job_result": {}
+    }
@@ -0,0 +1,68 @@
+import os
+import json
+import hashlib
+from functools import lru_cache
+
+import settings as st
+
+
+### Content-addressed store of parsed workflow files.
+### Byte-identical workflow files (e.g. copied from starter templates) are parsed and analyzed once by
+### 1_analyze_repository_data.py. repository_data refers to them by content_hash, and the analyzers load the
+### content, actions_list and context_data from WORKFLOW_STORE_DIR.
+### Entries of the lexical fast path (WORKFLOW_FAST_PATH) are kept apart, since they have no content.
+### Bump WORKFLOW_ANALYSIS_VERSION whenever the stored data would change for the same file (YAML loading,
+### get_actions_list, get_context_data or the lexical scanner), so that older entries are not reused.
+### Settings that change get_context_data (MATRIX_MAX_COMBINATIONS) are part of the path of the parsed entries; the
+### lexical entries have no context data to depend on them.
+WORKFLOW_ANALYSIS_VERSION = 7
+
+
+def get_content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+def get_store_path(content_hash, lexical=False):
+    version_dir = f"v{WORKFLOW_ANALYSIS_VERSION}-lexical" if lexical == True else f"v{WORKFLOW_ANALYSIS_VERSION}-m{st.MATRIX_MAX_COMBINATIONS}"
+    return os.path.join(st.WORKFLOW_STORE_DIR, version_dir, content_hash[:2], f"{content_hash}.json")
+
+
+def has_workflow(content_hash, lexical=False):
+    return os.path.exists(get_store_path(content_hash, lexical))
+
+
+def save_workflow(content_hash, workflow_data, lexical=False):
+    ### Written to a temporary file and renamed, so parallel workers (--jobs) and interrupted runs never leave a partial entry.
+    store_path = get_store_path(content_hash, lexical)
+    os.makedirs(os.path.dirname(store_path), exist_ok=True)
+    temp_path = f"{store_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(workflow_data, f)
+    os.replace(temp_path, store_path)
+
+
+@lru_cache(maxsize=st.WORKFLOW_STORE_CACHE_SIZE)
+def load_workflow(content_hash, lexical=False):
+    with open(get_store_path(content_hash, lexical), "r") as f:
+        return json.load(f)
+
+
+def resolve_repository_data(repository_data):
+    ### Returns repository_data with every stored workflow expanded to "is_valid", "content", "actions_list" and "context_data".
+    ### Repository data written before the store was introduced has the workflows inline and is returned as it is.
+    ### The expanded workflows are shared between repositories through the cache, so they must not be modified.
+    workflows = repository_data["WORKFLOWS_DATA"]["workflows"]
+    if not any("content_hash" in workflow_data for workflow_data in workflows.values()):
+        return repository_data
+
+    resolved_workflows = {}
+    for workflow_name, workflow_data in workflows.items():
+        if "content_hash" in workflow_data:
+            resolved_workflows[workflow_name] = {"is_valid": workflow_data["is_valid"], **load_workflow(workflow_data["content_hash"], workflow_data.get("lexical", False))}
+        else:
+            resolved_workflows[workflow_name] = workflow_data
+
+    resolved_repository_data = dict(repository_data)
+    resolved_repository_data["WORKFLOWS_DATA"] = dict(repository_data["WORKFLOWS_DATA"])
+    resolved_repository_data["WORKFLOWS_DATA"]["workflows"] = resolved_workflows
+    return resolved_repository_data
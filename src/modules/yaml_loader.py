@@ -0,0 +1,201 @@
+import io
+import re
+import signal
+import threading
+from contextlib import contextmanager
+import yaml
+
+import settings as st
+
+
+### yaml.safe_load with the libyaml-based CSafeLoader when PyYAML was built with it.
+### Tag resolution and construction are the same Python code in both loaders; only scanning and parsing run in C.
+### Whenever the C loader fails, the file is parsed again with the pure-Python SafeLoader, so invalid files keep the
+### same error messages as before.
+### libyaml accepts a few inputs that PyYAML rejects or reads differently (tabs as separators, "?" inside flow collections,
+### BOMs after the start, "#" right after a block scalar header, empty "!" tags); files containing them skip the C loader.
+### These characters are common in comments, quoted strings and `run: |` scripts (`[ ! -f x ]`, URLs with "?"), where both
+### loaders read them the same way, so a file matching C_LOADER_UNSAFE_PATTERN is looked at again without those parts.
+### Files over YAML_MAX_FILE_SIZE, YAML_MAX_EXPANDED_NODES or YAML_TIMEOUT raise YAMLLimitError and are not parsed further.
+
+C_LOADER_UNSAFE_PATTERN = re.compile(r"[\t?\ufeff]|[|>][-+0-9]*#|!(?=[\s,\[\]{}]|$)", re.MULTILINE)
+
+### Patterns for the lines outside block scalars, once comments are removed and quoted scalars emptied.
+BLOCK_UNSAFE_PATTERN = re.compile(r"[\t\ufeff]|[|>][-+0-9]*#|(?:^[ ]*(?:-[ ]+)*|:[ ]+)[?!](?=[\s,\[\]{}]|$)")
+FLOW_UNSAFE_PATTERN = re.compile(r"\?|!(?=[\s,\[\]{}]|$)")
+### A flow collection starts a node; "{" inside a plain scalar (`${{ ... }}`) does not start one.
+FLOW_START = re.compile(r"(?:^[ ]*(?:-[ ]+)*|:[ ]+)[\[{]")
+LINE_TOKEN = re.compile(r"""(?P<quoted>'(?:[^']|'')*'|"(?:[^"\\]|\\.)*")|(?P<comment>(?:^|(?<=\s))\#.*)|[^'"\#]+|.""")
+OTHER_LINE_BREAK = re.compile("[\ufeff\x85\u2028\u2029]|\r(?!\n)")
+QUOTE_OR_COMMENT = re.compile(r"['\"#]")
+### A quoted scalar starts a node; a quote inside a plain scalar (`it's`, `a 'b'`) does not start one.
+NODE_START = re.compile(r"(?:^|[\[{,])[ ]*(?:[-?][ ]+)*$|:[ ]+$")
+### "key: |", "- |", "- key: >-", ... without an indentation indicator. The content is every following line indented more
+### than the key (or the "-" of a "- |" entry).
+BLOCK_SCALAR_LINE = re.compile(r"""^([ ]*)((?:-[ ]+)*)((?:[^\s#'"][^#]*?|'[^'\n]*'|"[^"\n]*")[ ]*:[ ]+)?[|>][-+]?[ ]*$""")
+
+
+class YAMLLimitError(Exception):
+    pass
+
+
+def count_expanded_nodes(root):
+    ### Number of nodes once aliases are expanded, which is what json.dump and the analyzers walk.
+    ### A billion-laughs document is small as a node graph but explodes here. A recursive alias counts as one node.
+    sizes = {}
+    stack = [(root, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if children_done == True:
+            sizes[id(node)] = 1 + sum(sizes[id(child)] for child in get_child_nodes(node))
+            continue
+
+        if id(node) in sizes:
+            continue
+
+        sizes[id(node)] = 1
+        stack.append((node, True))
+        stack.extend((child, False) for child in get_child_nodes(node))
+
+    return sizes[id(root)]
+
+
+def get_child_nodes(node):
+    if isinstance(node, yaml.MappingNode):
+        return [child for pair in node.value for child in pair]
+    if isinstance(node, yaml.SequenceNode):
+        return node.value
+    return []
+
+
+def check_expanded_nodes(node):
+    if st.YAML_MAX_EXPANDED_NODES is None:
+        return
+
+    expanded_nodes = count_expanded_nodes(node)
+    if expanded_nodes > st.YAML_MAX_EXPANDED_NODES:
+        raise YAMLLimitError(f"{expanded_nodes} nodes after expanding aliases (YAML_MAX_EXPANDED_NODES: {st.YAML_MAX_EXPANDED_NODES})")
+
+
+class GuardedSafeLoader(yaml.SafeLoader):
+    def construct_document(self, node):
+        check_expanded_nodes(node)
+        return super().construct_document(node)
+
+
+if getattr(yaml, "__with_libyaml__", False) == True:
+    class GuardedCSafeLoader(yaml.CSafeLoader):
+        def construct_document(self, node):
+            check_expanded_nodes(node)
+            return super().construct_document(node)
+else:
+    GuardedCSafeLoader = None
+
+
+def raise_timeout(signum, frame):
+    raise YAMLLimitError(f"Parsing took more than {st.YAML_TIMEOUT} seconds (YAML_TIMEOUT)")
+
+
+@contextmanager
+def time_limit():
+    ### SIGALRM can only be handled in the main thread; elsewhere files are parsed without a time limit.
+    if st.YAML_TIMEOUT is None or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    previous_handler = signal.signal(signal.SIGALRM, raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, st.YAML_TIMEOUT)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def check_file_size(f):
+    if st.YAML_MAX_FILE_SIZE is None:
+        return
+
+    ### The end position of a text file that has not been read yet is its size in bytes.
+    file_size = f.seek(0, io.SEEK_END)
+    f.seek(0)
+    if file_size > st.YAML_MAX_FILE_SIZE:
+        raise YAMLLimitError(f"{file_size} bytes (YAML_MAX_FILE_SIZE: {st.YAML_MAX_FILE_SIZE})")
+
+
+def strip_line(line, in_flow=False):
+    ### The line without its comment and with quoted scalars emptied (tabs inside them are kept).
+    ### Inside a flow collection, a line may continue a plain scalar, so its start is not a node start.
+    prefix = "\0" if in_flow == True else ""
+    text = ""
+    position = 0
+    while position < len(line):
+        m = LINE_TOKEN.match(line, position)
+        if m.lastgroup == "comment":
+            break
+        if m.lastgroup == "quoted" and NODE_START.search(prefix + text) is None:
+            m = LINE_TOKEN.match(line[:position + 1], position)
+
+        token = m.group(0)
+        if m.lastgroup == "quoted":
+            token = token[0] + "\t" * token.count("\t") + token[0]
+        text += token
+        position = m.end()
+    return text
+
+
+def has_c_loader_unsafe_syntax(content):
+    if C_LOADER_UNSAFE_PATTERN.search(content) is None:
+        return False
+    ### BOMs, and line breaks other than "\n" and "\r\n" that would move the line boundaries seen below.
+    if OTHER_LINE_BREAK.search(content) is not None:
+        return True
+
+    flow_depth = 0
+    block_indent = None
+    for line in content.split("\n"):
+        line = line.rstrip("\r")
+        if block_indent is not None:
+            stripped = line.lstrip(" ")
+            if stripped == "" or len(line) - len(stripped) > block_indent:
+                continue
+            block_indent = None
+
+        text = strip_line(line, flow_depth > 0) if QUOTE_OR_COMMENT.search(line) is not None else line
+        ### The str tests skip the regular expressions on most lines.
+        if flow_depth == 0 and ("|" in text or ">" in text):
+            m = BLOCK_SCALAR_LINE.match(text)
+            if m is not None:
+                indent, entries, key = m.group(1), m.group(2), m.group(3)
+                if key is not None:
+                    block_indent = len(indent) + len(entries)
+                elif entries != "":
+                    block_indent = len(indent) + entries.rstrip(" ").rfind("-")
+
+        if ("\t" in text or "?" in text or "!" in text or "|" in text or ">" in text) and BLOCK_UNSAFE_PATTERN.search(text) is not None:
+            return True
+
+        if flow_depth > 0 or (("[" in text or "{" in text) and FLOW_START.search(text) is not None):
+            if FLOW_UNSAFE_PATTERN.search(text) is not None:
+                return True
+            flow_depth = max(0, flow_depth + text.count("[") + text.count("{") - text.count("]") - text.count("}"))
+
+    return False
+
+
+def safe_load(f):
+    ### f is a text file opened with repository.open().
+    check_file_size(f)
+    with time_limit():
+        if GuardedCSafeLoader is not None:
+            try:
+                content = f.read()
+                if has_c_loader_unsafe_syntax(content) == False:
+                    return yaml.load(content, Loader=GuardedCSafeLoader)
+            except YAMLLimitError:
+                raise
+            except Exception:
+                pass
+            f.seek(0)
+
+        return yaml.load(f, Loader=GuardedSafeLoader)
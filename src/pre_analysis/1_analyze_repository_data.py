@@ -7,7 +7,7 @@ from pathlib import Path
 import yaml
 import time
 import tqdm
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timezone
 from dateutil.relativedelta import relativedelta
 
@@ -15,6 +15,15 @@ sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 import settings as st
 from modules.github_context_parser import get_context_data
+from modules.journal import Journal
+from modules.error_replay import add_retry_error_arguments, get_retry_filter, select_repositories, merge_previous_results
+from modules.dirty_update import add_only_dirty_argument
+from modules.repository_reader import open_repository, open_text, get_repository_manifest
+from modules.clone_cache import mark_consumed
+from modules.seartghs import load_seartghs_index
+from modules import yaml_loader
+from modules import workflow_store
+from modules.workflow_scanner import scan_workflow, get_scanned_context_data
 
 def get_actions_list(workflow_content):
     actions_list = []
@@ -30,7 +39,12 @@ def get_actions_list(workflow_content):
 
 
 def get_workflows_data(repo_dir):
-    workflow_files = list(Path(os.path.join(repo_dir,".github/workflows")).rglob("*.y*ml"))
+    with open_repository(repo_dir) as repository:
+        return read_workflows_data(repository, get_repository_manifest(repository))
+
+
+def read_workflows_data(repository, manifest, verify_fast_path=False):
+    workflow_files = manifest["workflow_files"]
     
     workflows_data = {
         "workflows_num": len(workflow_files),
@@ -38,43 +52,143 @@ def get_workflows_data(repo_dir):
     }
 
     for workflow_file in workflow_files:
-        with open(workflow_file, "r") as f:
-            try:
-                workflow_content = yaml.safe_load(f)
-
-                if workflow_content is None:
-                    workflows_data["workflows"][workflow_file.name] = {
-                        "is_valid": False,
-                        "error": "Empty workflow file"
-                    }
-                    continue
-                
-                workflows_data["workflows"][workflow_file.name] = {
-                    "is_valid": True,
-                    "content": workflow_content,
-                    "actions_list": get_actions_list(workflow_content),
-                    "context_data": get_context_data(workflow_content),
-                }
-
-            except yaml.YAMLError as e:
-                workflows_data["workflows"][workflow_file.name] = {
-                    "is_valid": False,
-                    "error": f"Error parsing YAML: {str(e)}"
-                }
-
-            except Exception as e:
-                workflows_data["workflows"][workflow_file.name] = {
-                    "is_valid": False,
-                    "error": f"Unexpected error: {str(e)}"
-                }
+        workflow_name = os.path.basename(workflow_file)
+        workflows_data["workflows"][workflow_name] = read_workflow_file(repository, workflow_file, verify_fast_path)
 
     return workflows_data
 
 
+def read_workflow_file(repository, workflow_file, verify_fast_path=False):
+    ### The file is read once; a text stream over the bytes is built only when it has to be parsed.
+    try:
+        content = repository.read_bytes(workflow_file)
+    except Exception as e:
+        return {
+            "is_valid": False,
+            "error": f"Unexpected error: {str(e)}"
+        }
+
+    ### Identical files were already parsed and analyzed for another repository.
+    ### --verify-fast-path parses every file again so that the whole corpus is compared.
+    content_hash = workflow_store.get_content_hash(content)
+    if workflow_store.has_workflow(content_hash) and verify_fast_path == False:
+        return {
+            "is_valid": True,
+            "content_hash": content_hash
+        }
+
+    if st.WORKFLOW_FAST_PATH == True and verify_fast_path == False:
+        if workflow_store.has_workflow(content_hash, lexical=True):
+            return {
+                "is_valid": True,
+                "content_hash": content_hash,
+                "lexical": True
+            }
+
+        actions_list = scan_workflow(content)
+        if actions_list is not None:
+            workflow_store.save_workflow(content_hash, {
+                "content": None,
+                "actions_list": actions_list,
+                "context_data": get_scanned_context_data(),
+            }, lexical=True)
+            return {
+                "is_valid": True,
+                "content_hash": content_hash,
+                "lexical": True
+            }
+
+    with open_text(repository.repo_dir, workflow_file, content) as f:
+        workflow_data = parse_workflow_file(f)
+    if verify_fast_path == True:
+        verify_fast_path_result(os.path.join(repository.repo_dir, workflow_file), scan_workflow(content), workflow_data)
+
+    if workflow_data["is_valid"] == False:
+        return workflow_data
+
+    workflow_store.save_workflow(content_hash, {
+        "content": workflow_data["content"],
+        "actions_list": workflow_data["actions_list"],
+        "context_data": workflow_data["context_data"],
+    })
+    return {
+        "is_valid": True,
+        "content_hash": content_hash
+    }
+
+
+def parse_workflow_file(f):
+    try:
+        workflow_content = yaml_loader.safe_load(f)
+
+        if workflow_content is None:
+            return {
+                "is_valid": False,
+                "error": "Empty workflow file"
+            }
+
+        return {
+            "is_valid": True,
+            "content": workflow_content,
+            "actions_list": get_actions_list(workflow_content),
+            "context_data": get_context_data(workflow_content),
+        }
+
+    except yaml_loader.YAMLLimitError as e:
+        return {
+            "is_valid": False,
+            "error": f"Skipped: {str(e)}",
+            "is_skipped": True
+        }
+
+    except yaml.YAMLError as e:
+        return {
+            "is_valid": False,
+            "error": f"Error parsing YAML: {str(e)}"
+        }
+
+    except Exception as e:
+        return {
+            "is_valid": False,
+            "error": f"Unexpected error: {str(e)}"
+        }
+
+
+def verify_fast_path_result(workflow_path, scanned_actions_list, workflow_data):
+    ### Every file accepted by the lexical scanner has to give the same result as the full parse.
+    if scanned_actions_list is None:
+        return
+
+    if workflow_data["is_valid"] == True and workflow_data["actions_list"] == scanned_actions_list and workflow_data["context_data"] == get_scanned_context_data():
+        return
+
+    print(f"[Error] Fast path mismatch: {workflow_path}")
+
+
+def analyze_repository_files(repo_dir, verify_fast_path=False):
+    ### With --jobs this runs in a worker process: only the directory is sent, and the parsed data is sent back.
+    with open_repository(repo_dir) as repository:
+        manifest = get_repository_manifest(repository)
+        workflows_data = read_workflows_data(repository, manifest, verify_fast_path)
+    return workflows_data, manifest
+
+
+def iterate_repository_files(repo_dirs, jobs, verify_fast_path=False):
+    ### Yields (index, result) as repositories finish; the month output is put back in order when the journal is compacted.
+    if jobs <= 1:
+        for index, repo_dir in enumerate(repo_dirs):
+            yield index, analyze_repository_files(repo_dir, verify_fast_path)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(analyze_repository_files, repo_dir, verify_fast_path): index for index, repo_dir in enumerate(repo_dirs)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
 
-def process_month(year, month):
+def process_month(year, month, resume=False, retry_filter=None, only_dirty=False, jobs=1, verify_fast_path=False):
     output_path = os.path.join(st.REPOSITORY_DATA_DIR, f"repository_data_{year}_{month}.json")
-    if st.ALLOW_OVERWRITE == False and os.path.exists(output_path) == True:
+    if st.ALLOW_OVERWRITE == False and os.path.exists(output_path) == True and retry_filter is None and only_dirty == False:
         print(f'Skip: {year}-{month}')
         return
 
@@ -86,14 +200,14 @@ def process_month(year, month):
     with open(source_file1, "r") as f:
         source_data1 = json.load(f)
 
-    source_file2 = os.path.join(st.SEARTGHS_BY_MONTH_DIR, f"results_{year}_{month}.csv")
-    if os.path.exists(source_file2) == False:
-        print(f"[Error] File not found: {source_file2}")
+    seartghs_index = load_seartghs_index(year, month)
+    if seartghs_index is None:
         return
-    
-    with open(source_file2, "r") as f:
-        source_data2 = pd.read_csv(f)
 
+    selection = select_repositories(output_path, source_data1, retry_filter, only_dirty, year, month, "repository_data")
+    if selection is None:
+        return
+    repository_names, previous_results, journal_path = selection
 
     results = {
         "SEARCH_DATE": f'{year}-{month}',
@@ -103,33 +217,55 @@ def process_month(year, month):
         "ERROR": {}
     }
 
+    journal = Journal(journal_path, resume)
+
     count = 0
-    for repository_name in tqdm.tqdm(source_data1["True"],desc=f"{year}-{month}"):
+    pending_repository_names = []
+    for repository_name in repository_names:
         count += 1
         if st.DEBUG == True and count > st.DEBUG_DATA_NUM:
             print("\nDebug Mode: Stop after limited data")
             break
 
+        if journal.is_done(repository_name):
+            continue
+
         repo_dir = os.path.join(st.CLONED_DIR, repository_name)
         if not os.path.exists(repo_dir):
             # print(f"[Warning] Repository not found: {repository_name}")
-            results["ERROR"][repository_name] = "Repository data not found"
+            journal.append(repository_name, "ERROR", "Repository data not found")
+            continue
+
+        if repository_name not in seartghs_index:
+            journal.append(repository_name, "ERROR", "SEART-GHS data not found")
             continue
 
-        results["SUCCESS"][repository_name] = {}
+        pending_repository_names.append(repository_name)
 
-        df_seartghs_repository = source_data2[source_data2["name"] == repository_name] 
-        results["SUCCESS"][repository_name]["SEARTGHS_DATA"] = df_seartghs_repository.to_dict(orient="records")[0]
+    repo_dirs = [os.path.join(st.CLONED_DIR, repository_name) for repository_name in pending_repository_names]
+    for index, (workflows_data, manifest) in tqdm.tqdm(iterate_repository_files(repo_dirs, jobs, verify_fast_path), total=len(repo_dirs), desc=f"{year}-{month}"):
+        repository_name = pending_repository_names[index]
+        repository_data = {}
+        repository_data["SEARTGHS_DATA"] = seartghs_index[repository_name]
+        repository_data["WORKFLOWS_DATA"] = workflows_data
 
-        results["SUCCESS"][repository_name]["WORKFLOWS_DATA"] = get_workflows_data(repo_dir)
+        ### The manifest is kept so that the practice analyses do not walk the repository again.
+        repository_data["MANIFEST"] = manifest
+        journal.append(repository_name, "SUCCESS", repository_data)
 
         if st.LOOP_SLEEP_TIME > 0:
             time.sleep(st.LOOP_SLEEP_TIME)
     
+    journal.compact(results, repository_names)
     results["ENDED_AT"] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    results = merge_previous_results(previous_results, results, retry_filter, source_data1["True"])
+
     with open(output_path, "w") as f:
         json.dump(results, f, indent=4)
 
+    journal.remove()
+    mark_consumed("repository_data", results["SUCCESS"].keys())
+
 
 
 def generate_year_months(start, end):
@@ -138,9 +274,9 @@ def generate_year_months(start, end):
         yield current.year, current.month
         current += relativedelta(months=1)
 
-def process_range(start_date, end_date):
+def process_range(start_date, end_date, resume=False, retry_filter=None, only_dirty=False, jobs=1, verify_fast_path=False):
     for year, month in generate_year_months(start_date, end_date):
-        process_month(year, month)
+        process_month(year, month, resume, retry_filter, only_dirty, jobs, verify_fast_path)
 
 def main():
     parser = argparse.ArgumentParser(
@@ -152,12 +288,23 @@ def main():
     parser.add_argument(
         "--end", type=str, required=True, help="End year-month in format YYYY-MM (e.g., 2025-10)"
     )
+    parser.add_argument(
+        "--resume", action="store_true", help="Skip repositories already recorded in the journal of an interrupted run"
+    )
+    add_retry_error_arguments(parser)
+    add_only_dirty_argument(parser)
+    parser.add_argument(
+        "--jobs", type=int, default=1, help="Number of worker processes parsing repositories in parallel (default: 1)"
+    )
+    parser.add_argument(
+        "--verify-fast-path", action="store_true", help="Parse every workflow file and report the files for which the lexical fast path (WORKFLOW_FAST_PATH) gives a different result"
+    )
     args = parser.parse_args()
 
     start_date = datetime.strptime(args.start, "%Y-%m")
     end_date = datetime.strptime(args.end, "%Y-%m")
 
-    process_range(start_date, end_date)
+    process_range(start_date, end_date, args.resume, get_retry_filter(args), args.only_dirty, args.jobs, args.verify_fast_path)
 
 
 if __name__ == "__main__":
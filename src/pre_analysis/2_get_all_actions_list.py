@@ -14,6 +14,7 @@ from dateutil.relativedelta import relativedelta
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 import settings as st
+from modules.workflow_store import resolve_repository_data
 
 
 def get_actions_type_list(actions_list):
@@ -55,6 +56,7 @@ def process_month(year, month):
             print("\nDebug Mode: Stop after limited data")
             break
         
+        repository_data = resolve_repository_data(repository_data)
         for workflow_name, workflow_data in repository_data["WORKFLOWS_DATA"]["workflows"].items():
             if workflow_data["is_valid"] == False:
                 continue
@@ -10,24 +10,18 @@ from datetime import datetime, timezone
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
 import settings as st
-from modules.github_api import get_access_token, get_rate_limit, call_get_repository_tags_api, call_get_repository_branches_api
+from modules.github_api import get_client, get_repository_refs_graphql, call_get_repository_tags_api, call_get_repository_branches_api
 
 
 def get_pageinated_api_data(repository_name, api_caller):
-    access_token, expires_at = get_access_token()
     page_id = 1
     data_list = []
     while True:
-        is_success, result = api_caller(repository_name, access_token, page_id)
+        is_success, result = api_caller(repository_name, page_id=page_id)
         if not is_success:
             return False, result
 
         data_list.extend(result.json())
-        limit_num, remaining, reset_time_utc = get_rate_limit(result)
-        if int(remaining) <= 100:
-            sleep_seconds = (reset_time_utc - datetime.now(timezone.utc)).total_seconds() + 60
-            print(f"[WARNING] API limit nearly reached. Sleeping for {int(sleep_seconds)} seconds until reset...")
-            time.sleep(sleep_seconds)   
 
         if len(result.json()) < 100:
             return True, data_list
@@ -40,6 +34,26 @@ def get_repository_tags_list(repository_name):
 def get_repository_branches_list(repository_name):
     return get_pageinated_api_data(repository_name, call_get_repository_branches_api)
 
+def get_repository_refs_data(repository_name):
+    is_success_tags, result_tags = get_repository_tags_list(repository_name)
+    # if is_success_tags == False:
+    #     print(f"[Info] Failed to get tags for repository: {repository_name}")
+
+    is_success_branches, result_branches = get_repository_branches_list(repository_name)
+    # if is_success_branches == False:
+    #     print(f"[Info] Failed to get branches for repository: {repository_name}")
+
+    return {
+        "tags": {
+            "is_success": is_success_tags,
+            "data": result_tags
+        },
+        "branches": {
+            "is_success": is_success_branches,
+            "data": result_branches
+        }
+    }
+
 
 
 def main():
@@ -62,7 +76,10 @@ def main():
         "DATA": {}
     }
 
-    for actions in tqdm.tqdm(source_data["ACTIONS_LIST"]["public"]):
+    ### The list keeps the order of first appearance; the set is for the membership test.
+    repository_names = []
+    seen_repository_names = set()
+    for actions in source_data["ACTIONS_LIST"]["public"]:
         if "@" in actions:
             actions_name = actions.split("@")[0]
         else:
@@ -73,31 +90,29 @@ def main():
         else:
             repository_name = "/".join(actions_name.split("/")[0:2])
 
-        is_success_tags, result_tags = get_repository_tags_list(repository_name)
-        # if is_success_tags == False:
-        #     print(f"[Info] Failed to get tags for repository: {repository_name}")
-
-        is_success_branches, result_branches = get_repository_branches_list(repository_name)
-        # if is_success_branches == False:
-        #     print(f"[Info] Failed to get branches for repository: {repository_name}")
-
-        if repository_name in results["DATA"]:
+        if repository_name in seen_repository_names:
             # print(f"Already processed: {repository_name}")
             continue
 
-        results["DATA"][repository_name] = {
-            "tags": {
-                "is_success": is_success_tags,
-                "data": result_tags
-            },
-            "branches": {
-                "is_success": is_success_branches,
-                "data": result_branches
-            }
-        }
-
-        if st.LOOP_SLEEP_TIME > 0:
-            time.sleep(st.LOOP_SLEEP_TIME)
+        repository_names.append(repository_name)
+        seen_repository_names.add(repository_name)
+
+    with tqdm.tqdm(total=len(repository_names)) as progress_bar:
+        for batch_start in range(0, len(repository_names), st.API_BATCH_SIZE):
+            batch = repository_names[batch_start:batch_start + st.API_BATCH_SIZE]
+            if st.API_BACKEND == "GRAPHQL":
+                batch_results = get_repository_refs_graphql(batch)
+                for repository_name in batch:
+                    results["DATA"][repository_name] = batch_results[repository_name]
+            else:
+                batch_results = get_client().map(get_repository_refs_data, batch)
+                for repository_name, repository_refs_data in zip(batch, batch_results):
+                    results["DATA"][repository_name] = repository_refs_data
+
+            progress_bar.update(len(batch))
+
+            if st.LOOP_SLEEP_TIME > 0:
+                time.sleep(st.LOOP_SLEEP_TIME)
 
     results["ENDED_AT"] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
     with open(output_path, "w") as f:
@@ -15,6 +15,43 @@ ALLOW_OVERWRITE = True
 LOOP_SLEEP_TIME = 0     ## Interval (seconds) between processing loops.
 API_MAX_RETRIES = 3     ## Number of retry attempts for failed GitHub API requests.
 API_RETRY_DELAY = 10    ## Waiting time (seconds) before retrying a failed request.
+API_MAX_WORKERS = 8     ## Number of concurrent GitHub API requests (also the size of the connection pool).
+API_BATCH_SIZE = 100    ## Number of repositories submitted to the API worker pool at once.
+API_RATE_LIMIT_RESERVE = 100    ## Requests kept unused; when only this many remain, requests wait for the rate limit reset.
+API_PACING_THRESHOLD = 0.5      ## When less than this fraction of the rate limit remains, requests are spread evenly until the reset.
+API_TOKEN_REFRESH_MARGIN = 300  ## GitHub App installation tokens are refreshed in the background this many seconds before they expire.
+API_CACHE_ENABLED = True        ## Cache API responses with their ETag and replay them as conditional requests (304 responses are not rate limited).
+API_BACKEND = "REST"            ## "REST" or "GRAPHQL". The GraphQL backend aliases many repositories into one request.
+GRAPHQL_BATCH_SIZE = 50         ## Number of repositories (or ref lists) aliased into one GraphQL query.
+GITHUB_GRAPHQL_URL = "https://api.github.com/graphql"   ## GraphQL endpoint (can be pointed at a local fake endpoint for testing).
+
+### Options for splitting the SEART-GHS dataset.
+SEARTGHS_CHUNK_SIZE = 100000  ## Number of rows of results.csv processed at a time by 1_split_seartghs_by_month.py.
+
+### Options for cloning repositories.
+CLONE_MAX_WORKERS = 8   ## Number of repositories cloned in parallel.
+CLONE_TIMEOUT = 600     ## Time limit (seconds) for cloning one repository.
+CLONE_MAX_RETRIES = 2   ## Number of retry attempts for a failed or timed-out clone.
+CLONE_RETRY_DELAY = 10  ## Waiting time (seconds) before retrying a failed clone.
+CLONE_MODE = "FULL"     ## "FULL", "SPARSE", "BARE" or "API". SPARSE makes a shallow, blobless clone that checks out only the paths in modules/analyzed_paths.py.
+                        ## BARE keeps a shallow bare repository without a working tree, and the analyzers read files from its object database.
+                        ## API does not clone: the analyzed files are fetched through the Git trees/blobs API (a few API calls per repository).
+CLONE_CACHE_BUDGET_GB = None   ## Disk budget (GB) for cloned_repos. None disables eviction.
+CLONE_CACHE_STAGES = ["repository_data", "p1", "p5"]  ## Stages that read the clones. A clone is evicted only after all of them have read it.
+
+### Limits for loading workflow and dependabot YAML files. Files over a limit are skipped (recorded as invalid). None disables a limit.
+YAML_MAX_FILE_SIZE = 5 * 1024**2    ## Maximum file size (bytes).
+YAML_MAX_EXPANDED_NODES = 1000000   ## Maximum number of nodes after expanding aliases (guards against alias bombs).
+YAML_TIMEOUT = 30                   ## Time limit (seconds) for parsing one file.
+
+### Options for the workflow store (parsed workflow files shared by all repositories with identical files).
+WORKFLOW_STORE_CACHE_SIZE = 10000   ## Number of parsed workflows kept in memory by the analyzers.
+WORKFLOW_FAST_PATH = False          ## Read the actions of workflow files without "github.event." with a lexical scanner instead of a YAML parse.
+                                    ## Their content is not stored (null in the workflow store). Check with 1_analyze_repository_data.py --verify-fast-path.
+
+### Options for analyzing GitHub contexts in workflows.
+MATRIX_MAX_COMBINATIONS = 256       ## Maximum number of matrix combinations expanded per job (256 is the GitHub limit). Larger matrices
+                                    ## are not expanded, and each matrix.<key> may take any of its listed values. Part of the workflow store path.
 
 
 ### If you use Personal Access Token, uncomment the following lines and set the value.
@@ -29,6 +66,19 @@ PERSONAL_ACCESS_TOKEN = "[GITHUB_PERSONAL_ACCESS_TOKEN]"
 #     "PRIVATE_KEY_PATH": "[GITHUB_APP_PRIVATE_KEY_PATH]",
 # }
 
+### If you use multiple credentials, uncomment the following lines and set the values.
+### Each request is sent with the credential that has the most remaining rate limit.
+# TOKEN_MODE="TOKEN_POOL"
+# TOKEN_POOL = [
+#     {"TOKEN_MODE": "PERSONAL_ACCESS_TOKEN", "PERSONAL_ACCESS_TOKEN": "[GITHUB_PERSONAL_ACCESS_TOKEN_1]"},
+#     {"TOKEN_MODE": "PERSONAL_ACCESS_TOKEN", "PERSONAL_ACCESS_TOKEN": "[GITHUB_PERSONAL_ACCESS_TOKEN_2]"},
+#     {"TOKEN_MODE": "GITHUB_APP_TOKEN", "GITHUB_APP_CONFIG": {
+#         "APP_ID": "[GITHUB_APP_ID]",
+#         "INSTALLATION_ID": "[GITHUB_INSTALLATION_ID]",
+#         "PRIVATE_KEY_PATH": "[GITHUB_APP_PRIVATE_KEY_PATH]",
+#     }},
+# ]
+
 
 ### Define directory paths (DO NOT MODIFY)
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -37,8 +87,12 @@ SEARTGHS_BY_MONTH_DIR = os.path.join(BASE_DIR, "data/dataset/seartghs_by_month")
 REPO_WORKFLOWS_DIR = os.path.join(BASE_DIR, "data/dataset/repo_workflows")
 GHA_CHECK_DIR = os.path.join(BASE_DIR, "data/dataset/gha_check")
 CLONED_DIR = os.path.join(BASE_DIR, "data/dataset/cloned_repos")
+API_CACHE_DIR = os.path.join(BASE_DIR, "data/dataset/api_cache")
+JOURNAL_DIR = os.path.join(BASE_DIR, "data/dataset/journal")
+CLONE_CACHE_INDEX_PATH = os.path.join(BASE_DIR, "data/dataset/clone_cache_index.json")
 
 REPOSITORY_DATA_DIR = os.path.join(BASE_DIR, "data/analyzed_data/repository_data")
+WORKFLOW_STORE_DIR = os.path.join(BASE_DIR, "data/analyzed_data/workflow_store")
 ACTIONS_DATA_DIR = os.path.join(BASE_DIR, "data/analyzed_data/actions_data")
 RESULTS_DIR = os.path.join(BASE_DIR, "data/analyzed_data/results")
 
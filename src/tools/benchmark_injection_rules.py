@@ -0,0 +1,89 @@
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import yaml
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from modules.injection_rules import INJECTION_RULES, compile_rules, match_rules
+from modules.expression_parser import get_expression_sources
+
+
+### Microbenchmark of the injection rule scan per step: the CONTEXT_SIGNATURE check alone, the combined pattern of
+### match_rules and one pattern per rule.
+### python src/tools/benchmark_injection_rules.py [workflow files] [--repeat N]
+
+### One compiled pattern per rule.
+SEPARATE_PATTERNS = [(rule_id, compile_rules([(rule_id, contexts)])) for rule_id, contexts in INJECTION_RULES]
+
+
+def match_separately(text):
+    ### Unlike match_rules, a context also fires every more generic rule (e.g. "github_event").
+    sources = get_expression_sources(text)
+    return [rule_id for rule_id, pattern in SEPARATE_PATTERNS if any(pattern.search(source) is not None for source in sources)]
+
+
+def match_signature(text):
+    ### The check of get_context_data before the rules.
+    return "github.event." in text
+
+
+def get_step_texts(paths):
+    texts = []
+    for path in paths:
+        try:
+            with open(path, "r") as f:
+                workflow_content = yaml.safe_load(f)
+        except (OSError, yaml.YAMLError) as e:
+            print(f"[Warning] Skipped {path}: {e}")
+            continue
+        if not isinstance(workflow_content, dict):
+            continue
+        for job_data in (workflow_content.get("jobs") or {}).values():
+            for step in job_data.get("steps", []) or []:
+                for key in ("run", "with"):
+                    if step.get(key, None) is not None:
+                        texts.append(str(step[key]))
+    return texts
+
+
+def get_sample_texts():
+    return [
+        'echo "${{ github.event.issue.title }}"\nnpm ci\nnpm test',
+        "git checkout ${{ github.head_ref }}\ngit push origin HEAD:${{ github.event.pull_request.head.ref }}",
+        "{'body': '${{ github.event.comment.body }}', 'token': '${{ secrets.GITHUB_TOKEN }}'}",
+        'python scripts/release.py --sha "${{ github.sha }}" --tag "${{ github.event.release.tag_name }}"',
+        "make build\nmake test\n" * 20,
+    ]
+
+
+def benchmark(texts, repeat):
+    for name, function in [("signature only", match_signature), ("combined rules", match_rules), ("one pattern per rule", match_separately)]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            ### The expressions of a text are cached; every round scans them again.
+            get_expression_sources.cache_clear()
+            for text in texts:
+                function(text)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {elapsed / (repeat * len(texts)) * 1e6:.2f} us/step ({len(texts)} steps x {repeat})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark of the injection rule scan per step")
+    parser.add_argument("paths", nargs="*", help="Workflow files whose run/with blocks are scanned (default: built-in samples)")
+    parser.add_argument("--repeat", type=int, default=1000, help="Number of scans of every step")
+    args = parser.parse_args()
+
+    texts = get_step_texts(args.paths) if args.paths else get_sample_texts()
+    if texts == []:
+        print("[Error] No run or with blocks found")
+        sys.exit(1)
+
+    benchmark(texts, args.repeat)
+
+
+if __name__ == "__main__":
+    main()